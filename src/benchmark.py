@@ -0,0 +1,385 @@
+#! /usr/bin/env python3
+
+'''Benchmarks for the operations of musescore.py on synthetic scores.
+
+Generates MuseScore 3 scores with a configurable number of measures, VBox
+sections, clefs, layout breaks and staff texts, runs every operation in a
+separate process and prints the results as JSON, e.g.:
+
+    python benchmark.py --measures 2000 --sections 20 --output bench.json
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import contextlib
+import zipfile
+import argparse
+import platform
+import tempfile
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import musescore
+
+
+# the declaration written by musescore.py, with the non-ASCII titles below expat needs the encoding given explicitly
+HEADER = '''<?xml version='1.0' encoding='utf8'?>
+<museScore version="3.01">
+  <programVersion>3.6.2</programVersion>
+  <programRevision>3224f34</programRevision>
+  <Score>
+    <LayerTag id="0" tag="default"></LayerTag>
+    <currentLayer>0</currentLayer>
+    <Division>480</Division>
+    <showInvisible>1</showInvisible>
+    <showUnprintable>1</showUnprintable>
+    <showFrames>1</showFrames>
+    <showMargins>0</showMargins>
+    <metaTag name="workTitle">{title}</metaTag>
+'''
+
+PART = '''    <Part>
+{staffs}      <trackName>Piano</trackName>
+      <Instrument>
+        <longName>Piano</longName>
+        <instrumentId>keyboard.piano</instrumentId>
+        </Instrument>
+      </Part>
+'''
+
+PART_STAFF = '''      <Staff id="{id}">
+        <StaffType group="pitched">
+          <name>stdNormal</name>
+          </StaffType>
+        </Staff>
+'''
+
+VBOX = '''      <VBox>
+        <height>10</height>
+        <Text>
+          <style>Title</style>
+          <text>{title}</text>
+          </Text>
+        </VBox>
+'''
+
+KEYSIG = '''          <KeySig>
+            <accidental>{accidental}</accidental>
+            </KeySig>
+'''
+
+TIMESIG = '''          <TimeSig>
+            <sigN>4</sigN>
+            <sigD>4</sigD>
+            </TimeSig>
+'''
+
+CLEF = '''          <Clef>
+            <concertClefType>{clef}</concertClefType>
+            <transposingClefType>{clef}</transposingClefType>
+            </Clef>
+'''
+
+STAFFTEXT = '''          <StaffText>
+            <text>{text}</text>
+            </StaffText>
+'''
+
+CHORD = '''          <Chord>
+{dots}            <durationType>{duration}</durationType>
+            <Note>
+              <pitch>{pitch}</pitch>
+              <tpc>{tpc}</tpc>
+              </Note>
+            </Chord>
+'''
+
+REST = '''          <Rest>
+{dots}            <durationType>{duration}</durationType>
+            </Rest>
+'''
+
+MEASURE_REST = '''          <Rest>
+            <durationType>measure</durationType>
+            <duration>4/4</duration>
+            </Rest>
+'''
+
+LAYOUTBREAK = '''        <LayoutBreak>
+          <subtype>{subtype}</subtype>
+          </LayoutBreak>
+'''
+
+# rhythms filling a 4/4 measure, dotted durations are given as (duration, dots)
+RHYTHMS = [
+    ['quarter', 'quarter', 'quarter', 'quarter'],
+    ['half', 'half'],
+    ['half', 'quarter', 'quarter'],
+    ['quarter', 'eighth', 'eighth', 'half'],
+    [('half', 1), 'quarter'],
+    ['eighth'] * 8,
+    ['whole'],
+]
+
+
+def generate_score(measures=100, sections=1, staffs=1, clef_rate=0.05, line_break_rate=0.25, staff_texts=0, seed=0):
+    '''Returns the XML of a MuseScore 3 score as string.
+
+    Every section starts with a VBox holding its title and a key and time
+    signature, and ends with a section break. Measures get a clef change
+    and a line break with the given probabilities. The first staff_texts
+    measures of the first staff get a StaffText.
+    '''
+    rnd = random.Random(seed)
+    sections = max(1, min(sections, measures))
+    section_length = measures // sections
+    out = [HEADER.format(title='Benchmark')]
+    out.append(PART.format(staffs=''.join(PART_STAFF.format(id=i + 1) for i in range(staffs))))
+    for staff in range(staffs):
+        out.append('    <Staff id="{}">\n'.format(staff + 1))
+        for m in range(measures):
+            section = min(m // section_length, sections - 1)
+            position = m - section * section_length
+            if staff == 0 and position == 0:
+                out.append(VBOX.format(title='Stück {}'.format(section + 1)))
+            out.append('      <Measure>\n        <voice>\n')
+            if position == 0:
+                out.append(KEYSIG.format(accidental=rnd.randint(-3, 3)))
+                out.append(TIMESIG)
+            if rnd.random() < clef_rate:
+                out.append(CLEF.format(clef=rnd.choice(['F', 'G', 'C3'])))
+            if staff == 0 and m < staff_texts:
+                out.append(STAFFTEXT.format(text='Text {}'.format(m + 1)))
+            if rnd.random() < 0.1:
+                out.append(MEASURE_REST)
+            else:
+                for duration in rnd.choice(RHYTHMS):
+                    duration, dots = duration if isinstance(duration, tuple) else (duration, 0)
+                    dots = '            <dots>{}</dots>\n'.format(dots) if dots else ''
+                    if rnd.random() < 0.15:
+                        out.append(REST.format(dots=dots, duration=duration))
+                    else:
+                        out.append(CHORD.format(dots=dots, duration=duration, pitch=rnd.randint(48, 84), tpc=rnd.randint(10, 20)))
+            out.append('          </voice>\n')
+            last = m == measures - 1 or (position == section_length - 1 and section < sections - 1)
+            if last:
+                out.append(LAYOUTBREAK.format(subtype='section'))
+            elif rnd.random() < line_break_rate:
+                out.append(LAYOUTBREAK.format(subtype='line'))
+            out.append('        </Measure>\n')
+        out.append('      </Staff>\n')
+    out.append('    </Score>\n  </museScore>\n')
+    return ''.join(out)
+
+
+def write_score(xml, outpath):
+    '''Writes a generated score to a .mscx or .mscz file.'''
+    if outpath.endswith('.mscz'):
+        with zipfile.ZipFile(outpath, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('score.mscx', xml.encode('utf8'))
+            archive.writestr('META-INF/container.xml', '<?xml version="1.0" encoding="UTF-8"?>\n'
+                             '<container><rootfiles><rootfile full-path="score.mscx"/></rootfiles></container>\n')
+    else:
+        with open(outpath, 'w', encoding='utf8') as fd:
+            fd.write(xml)
+
+
+def _peak_rss_kib():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def bench_load(ctx, repeat):
+    for _ in range(repeat):
+        yield lambda: musescore.MuseScoreFile(ctx['path']).tree
+
+
+def bench_probe(ctx, repeat):
+    for _ in range(repeat):
+        yield lambda: musescore.MuseScoreFile.probe(ctx['path'])
+
+
+def bench_transform(ctx, repeat):
+    plan = musescore.TransformPlan(ctx['transforms'])
+    tree = musescore.MuseScoreFile(ctx['path']).tree
+    for _ in range(repeat):
+        clone = musescore.clone_tree(tree)
+        yield lambda: plan.apply(clone)
+
+
+def bench_write(ctx, repeat):
+    msf = musescore.MuseScoreFile(ctx['path'])
+    # the score is loaded on first use
+    msf.tree
+    for i in range(repeat):
+        yield lambda: msf.write(os.path.join(ctx['tempdir'], 'out{}{}'.format(i, ctx['ext'])))
+
+
+def bench_write_many(ctx, repeat):
+    msf = musescore.MuseScoreFile(ctx['path'])
+    msf.tree
+    for i in range(repeat):
+        outpaths = [os.path.join(ctx['tempdir'], 'many{}_{}{}'.format(i, n, ext)) for n in range(2) for ext in ('.mscx', '.mscz')]
+        yield lambda: msf.write_many(outpaths)
+
+
+def bench_merge(ctx, repeat):
+    files = [ctx['path']] * ctx['merge_files']
+    for i in range(repeat):
+        yield lambda: musescore.merge_files(files, os.path.join(ctx['tempdir'], 'merged{}.mscz'.format(i)))
+
+
+def bench_split(ctx, repeat):
+    msf = musescore.MuseScoreFile(ctx['path'])
+    msf.tree
+    for i in range(repeat):
+        outdir = os.path.join(ctx['tempdir'], 'split{}'.format(i))
+        os.mkdir(outdir)
+        yield lambda: msf.split(outdir)
+
+
+def bench_split_stream(ctx, repeat):
+    for i in range(repeat):
+        outdir = os.path.join(ctx['tempdir'], 'split_stream{}'.format(i))
+        os.mkdir(outdir)
+        # a score that is not loaded yet is streamed from its file
+        yield lambda: musescore.MuseScoreFile(ctx['path']).split(outdir)
+
+
+def _run(bench, ctx, repeat):
+    baseline = _peak_rss_kib()
+    times = []
+    # keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        for op in bench(ctx, repeat):
+            start = time.perf_counter()
+            op()
+            times.append(time.perf_counter() - start)
+    return min(times), baseline, _peak_rss_kib()
+
+
+def get_benchmarks(paths, params):
+    '''Returns the benchmarks as list of (name, function, context, factor).
+
+    The factor is the number of times the score is processed per run and
+    scales the throughput.
+    '''
+    benchmarks = [
+        ('load_mscx', bench_load, {'path': paths['.mscx']}, 1),
+        ('load_mscz', bench_load, {'path': paths['.mscz']}, 1),
+        ('probe_mscx', bench_probe, {'path': paths['.mscx']}, 1),
+        ('probe_mscz', bench_probe, {'path': paths['.mscz']}, 1),
+    ]
+    transforms = [musescore.SetTextAsTitle, musescore.RemoveNewlines, musescore.RemoveClefs,
+                  musescore.AddSectionBreak, musescore.FixKeySig]
+    for t in transforms:
+        # SetTextAsTitle only changes scores with a single VBox, with more it gives up right away
+        path = paths['single'] if t is musescore.SetTextAsTitle else paths['.mscx']
+        benchmarks.append(('transform_' + t.__name__, bench_transform, {'path': path, 'transforms': [t]}, 1))
+    benchmarks.append(('transform_all', bench_transform, {'path': paths['single'], 'transforms': transforms}, 1))
+    for ext in ('.mscx', '.mscz'):
+        benchmarks.append(('write' + ext.replace('.', '_'), bench_write, {'path': paths['.mscx'], 'ext': ext}, 1))
+    benchmarks.append(('write_many', bench_write_many, {'path': paths['.mscx']}, 4))
+    benchmarks.append(('merge_files', bench_merge, {'path': paths['.mscz'], 'merge_files': params['merge_files']}, params['merge_files']))
+    benchmarks.append(('split', bench_split, {'path': paths['.mscx']}, 1))
+    benchmarks.append(('split_stream', bench_split_stream, {'path': paths['.mscx']}, 1))
+    return benchmarks
+
+
+def run_benchmarks(params, repeat=3, only=None):
+    '''Generates the scores and runs all benchmarks, each in its own process.
+
+    Wall time is the best of all repetitions, peak RSS is the maximum of the
+    benchmark process including the setup (e.g. loading the score). The
+    processes are spawned, not forked, so they do not inherit the peak RSS of
+    this process, which holds the generated score. The baseline RSS is the peak
+    of the process before the benchmark starts (interpreter and imports).
+    '''
+    xml = generate_score(params['measures'], params['sections'], params['staffs'], params['clef_rate'],
+                         params['line_break_rate'], params['staff_texts'], params['seed'])
+    size = len(xml.encode('utf8'))
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        paths = {}
+        for ext in ('.mscx', '.mscz'):
+            paths[ext] = os.path.join(tempdir, 'score' + ext)
+            write_score(xml, paths[ext])
+        # the same score as a single section, for the title transform
+        paths['single'] = os.path.join(tempdir, 'single.mscx')
+        write_score(generate_score(params['measures'], 1, params['staffs'], params['clef_rate'], params['line_break_rate'],
+                                   params['staff_texts'], params['seed']), paths['single'])
+        with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+            for name, bench, ctx, factor in get_benchmarks(paths, params):
+                if only and name not in only:
+                    continue
+                ctx = dict(ctx, tempdir=tempdir)
+                wall_time, baseline_rss, peak_rss = pool.apply(_run, (bench, ctx, repeat))
+                results.append({
+                    'name': name,
+                    'wall_time': wall_time,
+                    'baseline_rss_kib': baseline_rss,
+                    'peak_rss_kib': peak_rss,
+                    'measures_per_s': params['measures'] * factor / wall_time if wall_time else None,
+                    'mb_per_s': size * factor / wall_time / 1e6 if wall_time else None,
+                })
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'xml_backend': musescore.get_xml_backend(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': dict(params, repeat=repeat, score_bytes=size),
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks musescore.py on synthetic scores.')
+    parser.add_argument('--measures', type=int, default=1000)
+    parser.add_argument('--sections', type=int, default=10)
+    parser.add_argument('--staffs', type=int, default=1)
+    parser.add_argument('--clef-rate', type=float, default=0.05)
+    parser.add_argument('--line-break-rate', type=float, default=0.25)
+    parser.add_argument('--staff-texts', type=int, default=1)
+    parser.add_argument('--merge-files', type=int, default=10, help='number of copies of the score merged')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', help='run only the named benchmark (can be repeated)')
+    parser.add_argument('--output', help='write JSON to this file instead of stdout')
+    parser.add_argument('--xml-backend', choices=['auto', 'lxml', 'etree'], help='XML library of musescore.py')
+    args = parser.parse_args(argv)
+    if args.xml_backend:
+        musescore.set_xml_backend(args.xml_backend)
+        os.environ['MST_XML_BACKEND'] = args.xml_backend
+
+    params = {
+        'measures': args.measures,
+        'sections': args.sections,
+        'staffs': args.staffs,
+        'clef_rate': args.clef_rate,
+        'line_break_rate': args.line_break_rate,
+        'staff_texts': args.staff_texts,
+        'merge_files': args.merge_files,
+        'seed': args.seed,
+    }
+    report = run_benchmarks(params, args.repeat, args.only)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+
+'''Catalog of the scores in directory trees, kept in an SQLite database.
+
+The catalog stores for every .mscx and .mscz file its modification time,
+size and hash, the number of staffs and measures, the key and time
+signatures of the first staff, the metaTag entries and the titles of its
+VBoxes (the titles split() names the parts after). Updates are
+incremental: files with unchanged modification time and size are skipped,
+changed files are only read again if their hash differs. New and changed
+files are read in a pool of worker processes.
+
+Inputs of merge and split jobs can then be selected by a query instead of
+by path, e.g.:
+
+    python -m mst catalog scores.db /shared/scores
+    python -m mst merge --catalog scores.db --title 'Ave*' book.mscz
+'''
+
+import os
+import time
+import logging
+import sqlite3
+import collections
+import concurrent.futures
+
+import musescore
+
+
+logger = logging.getLogger('mst_catalog')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    version TEXT,
+    staff_count INTEGER,
+    measure_count INTEGER,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS titles (
+    score_id INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    measure INTEGER NOT NULL,
+    title TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS titles_score ON titles (score_id);
+CREATE TABLE IF NOT EXISTS meta_tags (
+    score_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS meta_tags_score ON meta_tags (score_id);
+CREATE TABLE IF NOT EXISTS signatures (
+    score_id INTEGER NOT NULL,
+    measure INTEGER NOT NULL,
+    key_sig INTEGER,
+    time_sig TEXT
+);
+CREATE INDEX IF NOT EXISTS signatures_score ON signatures (score_id);
+'''
+
+CatalogUpdate = collections.namedtuple('CatalogUpdate', ['added', 'updated', 'unchanged', 'removed', 'failed'])
+
+# everything read from a file by a worker, see _read_score()
+_ScoreRecord = collections.namedtuple('_ScoreRecord', ['path', 'mtime_ns', 'size', 'hash', 'changed', 'version',
+                                                       'staff_count', 'measure_count', 'titles', 'meta_tags',
+                                                       'signatures', 'error'])
+
+
+def _like_pattern(pattern):
+    '''Translates a pattern with the wildcards * and ? to SQL LIKE.'''
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped.replace('*', '%').replace('?', '_')
+
+
+def _read_score(path, old_hash=None):
+    '''Reads the catalog data of a file, only stat and hash if the hash is old_hash.'''
+    st = os.stat(path)
+    file_hash = musescore.ConvertManifest.file_hash(path)
+    if file_hash == old_hash:
+        return _ScoreRecord(path, st.st_mtime_ns, st.st_size, file_hash, False, None, None, None, (), (), (), None)
+    roots = []
+    try:
+        # the header with the metaTags is read along with the staffs
+        outline = musescore.CompactScore(musescore.MuseScoreFile.iter_staff_content(path, roots))
+    except Exception as e:
+        return _ScoreRecord(path, st.st_mtime_ns, st.st_size, file_hash, True, None, None, None, (), (), (),
+                            '{}: {}'.format(type(e).__name__, e))
+    meta_tags = sorted((m.get('name'), m.text or '') for m in roots[0].iterfind('Score/metaTag'))
+    titles = [(part, measure, title) for part, (measure, title)
+              in enumerate(zip(outline.vbox_positions, outline.vbox_titles())) if title is not None]
+    signatures = []
+    if outline.staff_count > 0:
+        markers = musescore.CompactScore.KEY_SIG | musescore.CompactScore.TIME_SIG
+        for measure in outline.measures_with(markers):
+            key_sig = outline.key_sigs[0][measure]
+            sig_n = outline.time_sig_n[0][measure]
+            sig_d = outline.time_sig_d[0][measure]
+            signatures.append((measure, None if key_sig == outline.NO_KEY_SIG else key_sig,
+                               '{}/{}'.format(sig_n, sig_d) if sig_d else None))
+    return _ScoreRecord(path, st.st_mtime_ns, st.st_size, file_hash, True, roots[0].get('version'), outline.staff_count,
+                        outline.measure_count(), titles, meta_tags, signatures, None)
+
+
+def _read_score_task(task):
+    try:
+        return _read_score(*task)
+    except OSError:
+        # removed in the meantime
+        return None
+
+
+class Catalog(object):
+    '''SQLite catalog of scores, see the module documentation.'''
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @staticmethod
+    def _find_files(directories, recursive):
+        files = []
+        for directory in directories:
+            files.extend(os.path.abspath(path) for path in musescore.iter_score_files(directory, recursive))
+        # directories may overlap
+        return sorted(set(files))
+
+    def _known_files(self, directories, recursive):
+        '''Returns path: (id, mtime_ns, size, hash) for all cataloged files in the directories.'''
+        known = {}
+        directories = [os.path.abspath(d) for d in directories]
+        for score_id, path, mtime_ns, size, file_hash in self._db.execute(
+                'SELECT id, path, mtime_ns, size, hash FROM scores'):
+            parent = os.path.dirname(path)
+            if any(parent == d or (recursive and parent.startswith(os.path.join(d, ''))) for d in directories):
+                known[path] = (score_id, mtime_ns, size, file_hash)
+        return known
+
+    def _delete(self, score_id):
+        for table in ('titles', 'meta_tags', 'signatures'):
+            self._db.execute('DELETE FROM {} WHERE score_id = ?'.format(table), (score_id,))
+
+    def _store(self, record, score_id):
+        if not record.changed:
+            self._db.execute('UPDATE scores SET mtime_ns = ?, size = ? WHERE id = ?', (record.mtime_ns, record.size, score_id))
+            return
+        values = (record.path, record.mtime_ns, record.size, record.hash, record.version, record.staff_count,
+                  record.measure_count, record.error)
+        if score_id is None:
+            score_id = self._db.execute('INSERT INTO scores (path, mtime_ns, size, hash, version, staff_count, '
+                                        'measure_count, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', values).lastrowid
+        else:
+            self._delete(score_id)
+            self._db.execute('UPDATE scores SET path = ?, mtime_ns = ?, size = ?, hash = ?, version = ?, staff_count = ?, '
+                             'measure_count = ?, error = ? WHERE id = ?', values + (score_id,))
+        self._db.executemany('INSERT INTO titles VALUES (?, ?, ?, ?)', ((score_id,) + t for t in record.titles))
+        self._db.executemany('INSERT INTO meta_tags VALUES (?, ?, ?)', ((score_id,) + m for m in record.meta_tags))
+        self._db.executemany('INSERT INTO signatures VALUES (?, ?, ?, ?)', ((score_id,) + s for s in record.signatures))
+
+    def update(self, directories, workers=None, recursive=True):
+        '''Adds new and changed scores in the directories and removes deleted ones, returns a CatalogUpdate.
+
+        Files that cannot be read are cataloged with their error, so they are
+        only read again once they have changed, and are left out of queries.
+        The number of workers defaults to the number of CPUs, with a single
+        worker no pool is started.
+        '''
+        start = time.perf_counter()
+        known = self._known_files(directories, recursive)
+        tasks = []
+        unchanged = 0
+        for path in self._find_files(directories, recursive):
+            entry = known.pop(path, None)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed in the meantime
+                continue
+            if entry is not None and entry[1:3] == (st.st_mtime_ns, st.st_size):
+                unchanged += 1
+            else:
+                tasks.append((path, entry[3] if entry is not None else None))
+        with self._db:
+            for path, entry in known.items():
+                self._delete(entry[0])
+                self._db.execute('DELETE FROM scores WHERE id = ?', (entry[0],))
+        ids = {path: score_id for path, score_id in self._db.execute('SELECT path, id FROM scores')}
+        logger.info('Reading {} of {} scores'.format(len(tasks), len(tasks) + unchanged))
+
+        added = updated = 0
+        failed = []
+        if workers == 1:
+            records = map(_read_score_task, tasks)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+            records = executor.map(_read_score_task, tasks, chunksize=8)
+        try:
+            with self._db:
+                for (path, _), record in zip(tasks, records):
+                    if record is None:
+                        continue
+                    if not record.changed:
+                        unchanged += 1
+                    elif path in ids:
+                        updated += 1
+                    else:
+                        added += 1
+                    if record.error is not None:
+                        failed.append((path, record.error))
+                        logger.warning('Could not read {}: {}'.format(path, record.error))
+                    self._store(record, ids.get(path))
+        finally:
+            if workers != 1:
+                executor.shutdown()
+        logger.info('Updated catalog in {:.2f} s'.format(time.perf_counter() - start))
+        return CatalogUpdate(added, updated, unchanged, len(known), failed)
+
+    def find(self, title=None, meta=None, key_sig=None, time_sig=None, staff_count=None, directory=None, order='path'):
+        '''Returns the paths of all readable scores matching the query.
+
+        title matches the title of any VBox and meta is a dict of metaTag
+        names and values, both with the wildcards * and ? and ignoring case.
+        key_sig (number of accidentals, negative for flats) and time_sig (e.g.
+        '3/4') match if the first staff has the signature in any measure.
+        Scores are ordered by path or, with order 'title', by their first title.
+        '''
+        conditions = ['s.error IS NULL']
+        params = []
+        if title is not None:
+            conditions.append("EXISTS (SELECT 1 FROM titles t WHERE t.score_id = s.id AND t.title LIKE ? ESCAPE '\\')")
+            params.append(_like_pattern(title))
+        for name, value in sorted((meta or {}).items()):
+            conditions.append("EXISTS (SELECT 1 FROM meta_tags m WHERE m.score_id = s.id AND m.name = ? "
+                              "AND m.value LIKE ? ESCAPE '\\')")
+            params.extend((name, _like_pattern(value)))
+        if key_sig is not None:
+            conditions.append('EXISTS (SELECT 1 FROM signatures k WHERE k.score_id = s.id AND k.key_sig = ?)')
+            params.append(int(key_sig))
+        if time_sig is not None:
+            conditions.append('EXISTS (SELECT 1 FROM signatures k WHERE k.score_id = s.id AND k.time_sig = ?)')
+            params.append(time_sig)
+        if staff_count is not None:
+            conditions.append('s.staff_count = ?')
+            params.append(int(staff_count))
+        if directory is not None:
+            conditions.append("s.path LIKE ? ESCAPE '\\'")
+            params.append(_like_pattern(os.path.join(os.path.abspath(directory), '')) + '%')
+        if order == 'path':
+            order_by = 's.path'
+        elif order == 'title':
+            order_by = '(SELECT t.title FROM titles t WHERE t.score_id = s.id ORDER BY t.part LIMIT 1), s.path'
+        else:
+            raise ValueError('unknown order: {}'.format(order))
+        sql = 'SELECT s.path FROM scores s WHERE {} ORDER BY {}'.format(' AND '.join(conditions), order_by)
+        return [path for path, in self._db.execute(sql, params)]
+
+    def entry(self, path):
+        '''Returns everything cataloged about a file as dict, or None.'''
+        row = self._db.execute('SELECT id, path, mtime_ns, size, hash, version, staff_count, measure_count, error '
+                               'FROM scores WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        if row is None:
+            return None
+        score_id = row[0]
+        entry = dict(zip(('path', 'mtime_ns', 'size', 'hash', 'version', 'staff_count', 'measure_count', 'error'), row[1:]))
+        entry['titles'] = [title for title, in self._db.execute(
+            'SELECT title FROM titles WHERE score_id = ? ORDER BY part', (score_id,))]
+        entry['meta_tags'] = dict(self._db.execute('SELECT name, value FROM meta_tags WHERE score_id = ?', (score_id,)))
+        entry['signatures'] = [{'measure': measure, 'key_sig': key_sig, 'time_sig': time_sig}
+                               for measure, key_sig, time_sig in self._db.execute(
+                                   'SELECT measure, key_sig, time_sig FROM signatures WHERE score_id = ? ORDER BY measure',
+                                   (score_id,))]
+        return entry
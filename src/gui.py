@@ -1,14 +1,21 @@
 #! /usr/bin/env python3
 
+import os
 import sys
+import time
+import queue
 import logging
 import logging.handlers
+import threading
+import collections
+import concurrent.futures
 import tkinter as tk
 import tkinter.messagebox as messagebox
-from tkinter.ttk import Button, Label, Checkbutton
+from tkinter.ttk import Button, Label, Checkbutton, Progressbar, Scrollbar, Style, Treeview
 from tkinter.filedialog import askopenfilenames, asksaveasfilename, askopenfilename, askdirectory
 
 import musescore
+import instrumentation
 
 
 logger = logging.getLogger('mst_gui')
@@ -19,6 +26,7 @@ WIDTH = 600
 HEIGHT = 400
 PADX = 10
 PADY = 5
+POLL_INTERVAL = 100
 
 
 def center(win):
@@ -52,17 +60,231 @@ def create_logger():
     log_to_screen = logging.StreamHandler(sys.stdout)
     log_to_screen.setLevel(logging.INFO)
     logger.addHandler(log_to_screen)
+    # time spent per phase for every processed file, only on request because
+    # the instrumentation slows down every operation
+    if os.environ.get('MST_INSTRUMENTATION', '0') not in ('', '0'):
+        instrumentation.add_hook(log_report)
+
+
+def log_report(report):
+    logger.debug('Phases of {}'.format(report))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+ScanResult = collections.namedtuple('ScanResult', ['title', 'measure_count', 'staff_count', 'error'])
+
+
+def scan_score(path):
+    '''Reads title, number of measures and number of staffs of a score in a single streaming pass.'''
+    roots = []
+    try:
+        outline = musescore.CompactScore(musescore.MuseScoreFile.iter_staff_content(path, roots))
+    except Exception as e:
+        return ScanResult(None, None, None, str(e))
+    title = None
+    if outline.vbox_positions and outline.vbox_positions[0] == 0 and outline.vbox_texts[0]:
+        title = outline.vbox_texts[0][0]
+    if title is None and roots:
+        title = roots[0].findtext("Score/metaTag[@name='workTitle']") or None
+    return ScanResult(title, outline.measure_count(), outline.staff_count, None)
+
+
+class FileEntry(object):
+    '''A file in a FileListModel, info is its ScanResult once it has been read.'''
+    __slots__ = ('path', 'info', 'scanned', 'removed')
+
+    def __init__(self, path):
+        self.path = path
+        self.info = None
+        # set by the scanner thread, info is set by the GUI thread when the result arrives
+        self.scanned = False
+        self.removed = False
+
+
+class FileListModel(object):
+    '''Files of a FileListView and the selection.
+
+    The selection is a set of indices, so moving the selected files takes
+    time in proportion to the number of selected files, not to the length of
+    the list. Removing them takes a single pass over the list.
+    '''
+    def __init__(self):
+        self.entries = []
+        self.selection = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, paths):
+        '''Appends files and returns their entries.'''
+        entries = [FileEntry(path) for path in paths]
+        self.entries.extend(entries)
+        return entries
+
+    def paths(self):
+        return [entry.path for entry in self.entries]
+
+    def remove_selected(self):
+        '''Removes the selected files in a single pass over the list and returns their entries.'''
+        removed = []
+        kept = []
+        selection = self.selection
+        for i, entry in enumerate(self.entries):
+            if i in selection:
+                entry.removed = True
+                removed.append(entry)
+            else:
+                kept.append(entry)
+        self.entries = kept
+        self.selection = set()
+        return removed
+
+    def remove_all(self):
+        for entry in self.entries:
+            entry.removed = True
+        self.entries = []
+        self.selection = set()
+
+    def move_selected(self, direction):
+        '''Moves the selected files up (direction = -1) or down (direction = 1).
+
+        Files at the start or end of the list stay where they are and the
+        selected files following them stop behind them.
+        '''
+        entries = self.entries
+        moved = set()
+        # the file in front is moved first, so it makes room for the next one
+        for i in sorted(self.selection, reverse=direction > 0):
+            j = i + direction
+            if 0 <= j < len(entries) and j not in moved:
+                entries[i], entries[j] = entries[j], entries[i]
+                moved.add(j)
+            else:
+                moved.add(i)
+        self.selection = moved
+
+
+class ScoreScanner(object):
+    '''Reads the metadata of FileEntries with scan_score() on a background thread.
+
+    Entries are read in the order they were added, entries passed to
+    prioritize() (e.g. the rows currently shown) first. Results are put into
+    the results queue as (entry, ScanResult), for the GUI thread to pick up.
+    '''
+    def __init__(self):
+        self.results = queue.Queue()
+        self._pending = collections.deque()
+        self._priority = []
+        self._busy = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, entries):
+        with self._condition:
+            self._pending.extend(entries)
+            self._condition.notify()
+        if self._thread is None:
+            # a daemon thread does not keep the application from closing with files left to read
+            self._thread = threading.Thread(target=self._run, name='ScoreScanner', daemon=True)
+            self._thread.start()
+
+    def prioritize(self, entries):
+        '''Reads the given entries before all others, replaces the entries of an earlier call.'''
+        with self._condition:
+            self._priority = [entry for entry in reversed(entries) if not entry.scanned]
+            self._condition.notify()
+
+    def clear(self):
+        '''Drops all entries not read yet.'''
+        with self._condition:
+            self._pending.clear()
+            self._priority = []
+
+    def busy(self):
+        '''Returns whether entries are waiting or being read.'''
+        with self._condition:
+            return self._busy or bool(self._pending) or bool(self._priority)
+
+    def _next(self):
+        with self._condition:
+            self._busy = False
+            while True:
+                while self._priority:
+                    entry = self._priority.pop()
+                    if not entry.scanned and not entry.removed:
+                        self._busy = True
+                        return entry
+                while self._pending:
+                    entry = self._pending.popleft()
+                    if not entry.scanned and not entry.removed:
+                        self._busy = True
+                        return entry
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            entry.scanned = True
+            self.results.put((entry, scan_score(entry.path)))
 
 
 class FileListView(tk.Frame):
+    '''List of score files with their title, number of measures and staffs and whether they could be read.
+
+    Only the rows that fit into the window exist in the Treeview, they are
+    filled from the FileListModel whenever the list is scrolled or changed,
+    so the list can hold tens of thousands of files. The metadata is read
+    by a ScoreScanner in the background, the rows shown are read first.
+    '''
+    COLUMNS = (('path', 'Datei', 240), ('title', 'Titel', 160), ('measures', 'Takte', 50),
+               ('staffs', 'Notenzeilen', 80), ('status', 'Status', 100))
+
     def __init__(self, master=None):
         super().__init__(master)
         self.master = master
+        self.model = FileListModel()
+        self.scanner = ScoreScanner()
+        # index of the first row shown and number of rows that fit into the Treeview
+        self.first = 0
+        self.visible_rows = 1
+        self.row_count_estimated = True
+        # index the selection is extended from with shift and the arrow keys
+        self.anchor = None
+        self.cursor = None
+        self.rows = []
+        self.polling = False
         self.create_widgets()
 
     def create_widgets(self):
-        self.listbox = tk.Listbox(self, selectmode=tk.EXTENDED)
-        self.listbox.pack(padx=PADX, pady=PADY, fill=tk.BOTH, expand=True)
+        listframe = tk.Frame(self)
+        # the Treeview does not select anything itself, the selection is kept in the model
+        self.tree = Treeview(listframe, columns=[c[0] for c in self.COLUMNS], show='headings', selectmode='none')
+        for column, heading, width in self.COLUMNS:
+            self.tree.heading(column, text=heading, anchor=tk.W)
+            self.tree.column(column, width=width, stretch=column in ('path', 'title'))
+        self.tree.tag_configure('error', foreground='red')
+        self.tree.bind('<Configure>', self.on_configure)
+        self.tree.bind('<Button-1>', lambda event: self.on_click(event, 'set'))
+        self.tree.bind('<Shift-Button-1>', lambda event: self.on_click(event, 'extend'))
+        self.tree.bind('<Control-Button-1>', lambda event: self.on_click(event, 'toggle'))
+        self.tree.bind('<MouseWheel>', lambda event: self.on_scroll('scroll', -3 if event.delta > 0 else 3, 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.on_scroll('scroll', -3, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.on_scroll('scroll', 3, 'units'))
+        self.tree.bind('<Up>', lambda event: self.on_key(-1, False))
+        self.tree.bind('<Down>', lambda event: self.on_key(1, False))
+        self.tree.bind('<Shift-Up>', lambda event: self.on_key(-1, True))
+        self.tree.bind('<Shift-Down>', lambda event: self.on_key(1, True))
+        self.tree.bind('<Prior>', lambda event: self.on_key(-self.visible_rows, False))
+        self.tree.bind('<Next>', lambda event: self.on_key(self.visible_rows, False))
+        self.tree.bind('<Control-a>', self.on_select_all)
+        self.tree.bind('<Delete>', lambda event: self.on_remove_file())
+        self.scrollbar = Scrollbar(listframe, orient=tk.VERTICAL, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        listframe.pack(padx=PADX, pady=PADY, fill=tk.BOTH, expand=True)
         self.buttonframe = tk.Frame(self)
         add_button = Button(self.buttonframe, text='+', command=self.on_add_files)
         add_button.pack(side=tk.LEFT, padx=PADX, anchor=tk.W)
@@ -74,51 +296,177 @@ class FileListView(tk.Frame):
         down_button.pack(side=tk.LEFT, padx=PADX, anchor=tk.W)
         remove_all_button = Button(self.buttonframe, text='x', command=self.on_remove_all_files)
         remove_all_button.pack(side=tk.RIGHT, padx=PADX, anchor=tk.E)
+        self.count_label = Label(self.buttonframe, text='')
+        self.count_label.pack(side=tk.RIGHT, padx=PADX, anchor=tk.E)
         self.buttonframe.pack(padx=PADX, pady=PADY, fill=tk.X)
 
     def on_remove_all_files(self):
-        self.listbox.delete(0, tk.END)
+        self.scanner.clear()
+        self.model.remove_all()
+        self.first = 0
+        self.anchor = self.cursor = None
+        self.redraw()
 
     def on_add_files(self):
         filenames = askopenfilenames(initialdir='.', title = 'MuseScore-Dateien auswählen...',
                                      filetypes =(('MuseScore-Dateien', '.mscx .mscz'),('Alle Dateien','*.*')))
         logger.info('Chosen files: {}'.format(filenames))
-        if type(filenames) == tuple:
-            for f in filenames:
-                self.listbox.insert(tk.END, f)
-        else:
-            self.listbox.insert(tk.END, filenames)
+        if type(filenames) != tuple:
+            filenames = (filenames,) if filenames else ()
+        if filenames:
+            self.add_files(filenames)
+
+    def add_files(self, paths):
+        self.scanner.add(self.model.add(paths))
+        self.redraw()
+        self.start_polling()
 
     def on_remove_file(self):
-        selected_files = self.listbox.curselection()
-        if selected_files:
-            for i in selected_files:
-                self.listbox.delete(i)
+        if self.model.selection:
+            self.model.remove_selected()
+            self.anchor = self.cursor = None
+            self.redraw()
 
     def on_move_file(self, direction):
         """
-        Moves item in Listbox up (direction = -1) or down (direction = 1).
+        Moves the selected items up (direction = -1) or down (direction = 1).
         """
-        # Source: https://stackoverflow.com/a/52763936
-        selected_files = self.listbox.curselection()
-        if not selected_files:
+        if not self.model.selection:
+            return
+        self.model.move_selected(direction)
+        if self.cursor is not None:
+            self.cursor = max(0, min(self.cursor + direction, len(self.model) - 1))
+        self.show(min(self.model.selection) if direction < 0 else max(self.model.selection))
+
+    def on_click(self, event, mode):
+        if self.tree.identify_region(event.x, event.y) not in ('cell', 'tree'):
+            # headings and column separators are handled by the Treeview
+            return
+        row = self.tree.identify_row(event.y)
+        if row not in self.rows:
             return
-        for f in selected_files:
-            if direction == -1 and f == 0:
-                continue
-            if direction == 1 and f == len(self.listbox.get(0, tk.END)) - 1:
-                continue
-            text = self.listbox.get(f)
-            self.listbox.delete(f)
-            self.listbox.insert(f + direction, text)
-            self.listbox.selection_set(f + direction)
-
-    def on_move_file_down(self):
-        if self.listbox.curselection:
+        index = self.first + self.rows.index(row)
+        if mode == 'extend' and self.anchor is not None:
+            self.model.selection = set(range(min(self.anchor, index), max(self.anchor, index) + 1))
+        elif mode == 'toggle':
+            self.model.selection ^= {index}
+            self.anchor = index
+        else:
+            self.model.selection = {index}
+            self.anchor = index
+        self.cursor = index
+        self.redraw()
+
+    def on_key(self, delta, extend):
+        if not len(self.model):
+            return 'break'
+        index = 0 if self.cursor is None else max(0, min(self.cursor + delta, len(self.model) - 1))
+        if extend and self.anchor is not None:
+            self.model.selection = set(range(min(self.anchor, index), max(self.anchor, index) + 1))
+        else:
+            self.model.selection = {index}
+            self.anchor = index
+        self.cursor = index
+        self.show(index)
+        # keeps the Treeview from moving its own focus
+        return 'break'
+
+    def on_select_all(self, event=None):
+        self.model.selection = set(range(len(self.model)))
+        self.redraw()
+        return 'break'
+
+    def on_scroll(self, *args):
+        # arguments of a scrollbar command: moveto fraction or scroll number units|pages
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.model))
+        elif args[0] == 'scroll':
+            self.first += int(args[1]) * (self.visible_rows if args[2] == 'pages' else 1)
+        self.redraw()
+        return 'break'
+
+    def on_configure(self, event):
+        self.update_row_count(event.height)
+
+    def update_row_count(self, height=None):
+        if height is None:
+            height = self.tree.winfo_height()
+        bbox = self.tree.bbox(self.rows[0]) if self.rows else ''
+        if bbox:
+            # the heading is above the first row
+            top, row_height = bbox[1], bbox[3]
+        else:
+            row_height = int(Style().lookup('Treeview', 'rowheight') or 20)
+            top = row_height
+        self.row_count_estimated = not bbox
+        visible_rows = max(1, (height - top) // row_height)
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.redraw()
+
+    def show(self, index):
+        '''Scrolls the list so the given row is shown.'''
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + self.visible_rows:
+            self.first = index - self.visible_rows + 1
+        self.redraw()
+
+    def redraw(self):
+        '''Fills the rows of the Treeview with the files shown.'''
+        entries = self.model.entries
+        self.first = max(0, min(self.first, len(entries) - self.visible_rows))
+        shown = entries[self.first:self.first + self.visible_rows]
+        while len(self.rows) > len(shown):
+            self.tree.delete(self.rows.pop())
+        while len(self.rows) < len(shown):
+            self.rows.append(self.tree.insert('', tk.END))
+        selected = []
+        for i, (row, entry) in enumerate(zip(self.rows, shown)):
+            info = entry.info
+            if info is None:
+                values = (entry.path, '', '', '', 'Wird gelesen...')
+            elif info.error is not None:
+                values = (entry.path, '', '', '', 'Fehler: {}'.format(info.error))
+            else:
+                values = (entry.path, info.title or '', info.measure_count, info.staff_count, 'OK')
+            self.tree.item(row, values=values, tags=('error',) if info is not None and info.error is not None else ())
+            if self.first + i in self.model.selection:
+                selected.append(row)
+        self.tree.selection_set(selected)
+        if entries:
+            self.scrollbar.set(self.first / len(entries), min(1.0, (self.first + len(shown)) / len(entries)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.count_label['text'] = '{} {}'.format(len(entries), 'Datei' if len(entries) == 1 else 'Dateien') if entries else ''
+        self.scanner.prioritize([entry for entry in shown if entry.info is None])
+        if self.row_count_estimated and self.rows:
+            # the size of the rows is known once they are shown
+            self.after_idle(self.update_row_count)
+
+    def start_polling(self):
+        if not self.polling:
+            self.polling = True
+            self.after(POLL_INTERVAL, self.poll_scanner)
+
+    def poll_scanner(self):
+        changed = False
+        try:
+            while True:
+                entry, info = self.scanner.results.get_nowait()
+                entry.info = info
+                changed = changed or not entry.removed
+        except queue.Empty:
             pass
+        if changed:
+            self.redraw()
+        if self.scanner.busy() or not self.scanner.results.empty():
+            self.after(POLL_INTERVAL, self.poll_scanner)
+        else:
+            self.polling = False
 
     def get_file_list(self):
-        return self.listbox.get(0, tk.END)
+        return self.model.paths()
 
 
 class MainWindow(tk.Frame):
@@ -128,8 +476,13 @@ class MainWindow(tk.Frame):
         self.output_file = ''
         self.split_input_file = ''
         self.split_output_dir = ''
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.job = None
+        self.job_queue = queue.Queue()
+        self.cancel_event = threading.Event()
         master.title(APP_NAME)
         master.minsize(WIDTH, HEIGHT)
+        master.protocol('WM_DELETE_WINDOW', self.on_close)
         # master.geometry('{}x{}'.format(WIDTH, HEIGHT))
         # photo = tk.PhotoImage(file='./images/mscore3.png')
         # master.iconphoto(False, photo)
@@ -141,6 +494,7 @@ class MainWindow(tk.Frame):
         nb.add(self.create_merge_widgets(nb), text='Zusammenführen...')
         nb.add(self.create_split_widgets(nb), text='Aufteilen...')
         nb.enable_traversal()
+        self.create_progress_widgets(root).pack(padx=PADX, pady=PADY, fill=tk.X)
 
     def create_convert_widgets(self, notebook):
         frame = tk.Frame(notebook)
@@ -191,6 +545,101 @@ class MainWindow(tk.Frame):
         split_button.pack(padx=PADX, pady=PADY)
         return frame
 
+    def create_progress_widgets(self, master):
+        frame = tk.Frame(master)
+        self.progressbar = Progressbar(frame, mode='determinate')
+        self.progressbar.pack(side=tk.LEFT, padx=PADX, pady=PADY, fill=tk.X, expand=True)
+        self.cancel_button = Button(frame, text='Abbrechen', command=self.on_cancel, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT, padx=PADX, pady=PADY)
+        self.status_label = Label(frame, text='', width=40)
+        self.status_label.pack(side=tk.RIGHT, padx=PADX, pady=PADY)
+        return frame
+
+    def start_job(self, work, error_title):
+        """
+        Runs work(progress) on the worker thread. The function has to call
+        progress(done, total, path) after every file, the job can be cancelled
+        at these points.
+        """
+        if self.job is not None:
+            messagebox.showinfo('Vorgang läuft', 'Es läuft bereits ein Vorgang.')
+            return
+        self.cancel_event.clear()
+        self.job_error_title = error_title
+        self.job_start = time.perf_counter()
+        self.progressbar['value'] = 0
+        self.status_label['text'] = 'Starte...'
+        self.cancel_button['state'] = tk.NORMAL
+        self.job = self.executor.submit(self.run_job, work)
+        self.after(POLL_INTERVAL, self.poll_job)
+
+    def run_job(self, work):
+        # runs on the worker thread, results are passed to the GUI through the queue
+        try:
+            work(self.report_progress)
+        except JobCancelled:
+            self.job_queue.put(('cancelled',))
+        except Exception as e:
+            self.job_queue.put(('error', e))
+        else:
+            self.job_queue.put(('done',))
+
+    def report_progress(self, done, total, path):
+        self.job_queue.put(('progress', done, total, path))
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def poll_job(self):
+        try:
+            while True:
+                self.handle_job_message(*self.job_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if self.job is not None:
+            self.after(POLL_INTERVAL, self.poll_job)
+
+    def handle_job_message(self, kind, *args):
+        if kind == 'progress':
+            done, total, path = args
+            logger.info('Processed file {}/{}: {}'.format(done, total, path))
+            elapsed = time.perf_counter() - self.job_start
+            rate = done / elapsed if elapsed > 0 else 0
+            self.progressbar['maximum'] = max(total, 1)
+            self.progressbar['value'] = done
+            if rate > 0:
+                self.status_label['text'] = '{}/{} Dateien, {:.1f} Dateien/s, noch ca. {:.0f} s'.format(done, total, rate, (total - done) / rate)
+            else:
+                self.status_label['text'] = '{}/{} Dateien'.format(done, total)
+            return
+
+        self.job = None
+        self.cancel_button['state'] = tk.DISABLED
+        if kind == 'done':
+            self.status_label['text'] = 'Fertig nach {:.1f} s'.format(time.perf_counter() - self.job_start)
+        elif kind == 'cancelled':
+            logging.info('Job cancelled.')
+            self.status_label['text'] = 'Abgebrochen'
+        elif kind == 'error':
+            e = args[0]
+            logging.error('Error while processing files: {}'.format(e))
+            self.status_label['text'] = 'Fehler'
+            messagebox.showerror(self.job_error_title, 'Es trat der folgende Fehler auf: {}'.format(e))
+
+    def on_cancel(self):
+        if self.job is not None:
+            self.cancel_event.set()
+            self.status_label['text'] = 'Breche nach aktueller Datei ab...'
+
+    def on_close(self):
+        # the interpreter waits for the worker thread on exit, so a running job
+        # is cancelled after the current file and queued ones are dropped
+        self.cancel_event.set()
+        if sys.version_info >= (3, 9):
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            self.executor.shutdown(wait=False)
+        self.master.destroy()
+
     def on_choose_output_file(self):
         filename = asksaveasfilename(initialdir='.', title = 'Ausgabedatei auswählen...',
                                      filetypes =(('MuseScore-Dateien', '.mscx .mscz'),('Alle Dateien','*.*')))
@@ -218,11 +667,12 @@ class MainWindow(tk.Frame):
             files = self.merge_file_list_view.get_file_list()
             if files:
                 logging.info('Merging files ({}) to output file: {}.'.format(files, self.output_file))
-                try:
-                    musescore.merge_files(files, self.output_file)
-                except musescore.MuseScoreException as e:
-                    logging.error('Error while merging files: {}'.format(e))
-                    messagebox.showerror('Fehler während des Zusammenführens', 'Es trat der folgende Fehler auf: {}'.format(e))
+                output_file = self.output_file
+
+                def work(progress):
+                    musescore.merge_files(files, output_file, progress=progress)
+
+                self.start_job(work, 'Fehler während des Zusammenführens')
             else:
                 logging.error('No input files for merging chosen!')
                 messagebox.showerror('Keine Eingabedateien ausgewählt', 'Es sind keine Eingabedateien ausgewählt.')
@@ -238,12 +688,16 @@ class MainWindow(tk.Frame):
             return
         if files:
             logging.info('Converting files: {}'.format(files))
-            try:
-                musescore.convert_files(files, copy_titles=self.copy_titles.get(), remove_newlines=self.remove_newline.get(),
-                                        remove_clefs=self.remove_clefs.get(), add_section_break=self.add_section_break.get(), fix_key_sig=self.fix_key_sig.get())
-            except musescore.MuseScoreException as e:
-                logging.error('Error while converting files: {}'.format(e))
-                messagebox.showerror('Fehler während des Konvertierens', 'Es trat der folgende Fehler auf: {}'.format(e))
+            plan = musescore.TransformPlan.from_options(copy_titles=self.copy_titles.get(), remove_newlines=self.remove_newline.get(),
+                                                        remove_clefs=self.remove_clefs.get(), add_section_break=self.add_section_break.get(),
+                                                        fix_key_sig=self.fix_key_sig.get())
+
+            def work(progress):
+                for i, f in enumerate(files):
+                    musescore.convert_file(f, plan)
+                    progress(i + 1, len(files), f)
+
+            self.start_job(work, 'Fehler während des Konvertierens')
         else:
             logging.error('No input files for converting chosen!')
             messagebox.showerror('Keine Eingabedateien ausgewählt', 'Es sind keine Eingabedateien ausgewählt.')
@@ -252,12 +706,14 @@ class MainWindow(tk.Frame):
         if self.split_output_dir:
             if self.split_input_file:
                 logging.info('Splitting file ({}) to output dir: {}.'.format(self.split_input_file, self.split_output_dir))
-                try:
-                    m = musescore.MuseScoreFile(self.split_input_file)
-                    m.split(self.split_output_dir)
-                except musescore.MuseScoreException as e:
-                    logging.error('Error while splitting files: {}'.format(e))
-                    messagebox.showerror('Fehler während des Aufteilens', 'Es trat der folgende Fehler auf: {}'.format(e))    
+                split_input_file = self.split_input_file
+                split_output_dir = self.split_output_dir
+
+                def work(progress):
+                    m = musescore.MuseScoreFile(split_input_file)
+                    m.split(split_output_dir, progress=progress)
+
+                self.start_job(work, 'Fehler während des Aufteilens')
             else:
                 logging.error('No input file for splitting chosen!')
                 messagebox.showerror('Kein Eingabedatei ausgewählt', 'Es ist kein Eingabedatei ausgewählt.')
@@ -0,0 +1,256 @@
+
+'''Opt-in instrumentation of the operations of musescore.py.
+
+When enabled, every top-level operation on a file (loading, writing,
+converting, merging or splitting) collects a Report with the time spent in
+each phase and counters like bytes read and written, elements visited and
+measures processed. Finished reports are passed to all hooks and logged as
+structured records (the report as dict in the attribute mst_report) on the
+logger 'musescore.instrumentation', e.g.:
+
+    import instrumentation
+    instrumentation.add_hook(lambda report: print(report))
+
+Phase times are exclusive, time spent in a nested phase (e.g. reading from
+the archive while parsing) only counts for the nested phase. Phases are:
+
+    read        reading the score, for .mscz files including decompression
+    parse       building elements from the XML
+    clone       copying a tree shared with a ScoreCache
+    index       building the ScoreIndex
+    transform   applying a TransformPlan
+    serialize   creating XML from elements
+    write       writing the score, for .mscz files including compression
+    compress    compressing the score once for several archives, see MuseScoreFile.write_many()
+    copy        copying other archive entries and backups
+    sync        waiting until written files are on disk
+    hash        hashing files for a ConvertManifest
+    check       checking the extracted durations of a score, see validation.py
+
+When disabled, operation() and phase() return a shared no-op context manager
+and files are not wrapped, so the overhead is a few attribute lookups per
+operation.
+'''
+
+import time
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger('musescore.instrumentation')
+
+enabled = False
+_hooks = []
+_local = threading.local()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def add_hook(hook):
+    '''Registers hook(report), called after every operation, and enables the instrumentation.'''
+    _hooks.append(hook)
+    enable()
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class Report(object):
+    '''Phase timings and counters of an operation on a file.'''
+    def __init__(self, operation, path):
+        self.operation = operation
+        self.path = path
+        self.success = True
+        self.duration = 0.0
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        # split writes its parts from several threads
+        self._lock = threading.Lock()
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def as_dict(self):
+        return {'operation': self.operation, 'path': self.path, 'success': self.success, 'duration': self.duration,
+                'phases': dict(self.phases), 'counters': dict(self.counters)}
+
+    @classmethod
+    def from_dict(cls, d):
+        report = cls(d['operation'], d['path'])
+        report.success = d['success']
+        report.duration = d['duration']
+        report.phases.update(d['phases'])
+        report.counters.update(d['counters'])
+        return report
+
+    def __str__(self):
+        details = ['{} {:.3f} s'.format(name, seconds) for name, seconds in self.phases.items()]
+        details.extend('{} {}'.format(name, n) for name, n in self.counters.items())
+        return '{} {}{}: {:.3f} s{}'.format(self.operation, self.path, '' if self.success else ' (failed)', self.duration,
+                                           ' ({})'.format(', '.join(details)) if details else '')
+
+
+def emit(report):
+    '''Passes a finished report to all hooks and logs it.'''
+    for hook in list(_hooks):
+        hook(report)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(str(report), extra={'mst_report': report.as_dict()})
+
+
+def current():
+    '''Returns the report of the operation running in this thread or None.'''
+    if not enabled:
+        return None
+    return getattr(_local, 'report', None)
+
+
+class _Null(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL = _Null()
+
+
+class _Phase(object):
+    __slots__ = ('report', 'name', 'start', 'children')
+
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        self.children = 0.0
+        _local.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        self.report.add_time(self.name, elapsed - self.children)
+        if stack:
+            stack[-1].children += elapsed
+        return False
+
+
+class _Operation(object):
+    def __init__(self, report, emit_report):
+        self.report = report
+        self.emit_report = emit_report
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'report', None), getattr(_local, 'stack', None)
+        _local.report = self.report
+        _local.stack = []
+        self.start = time.perf_counter()
+        return self.report
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.report.duration += time.perf_counter() - self.start
+        if exc_type is not None:
+            self.report.success = False
+        _local.report, _local.stack = self.previous
+        if self.emit_report:
+            emit(self.report)
+        return False
+
+
+def operation(name, path, emit_report=True):
+    '''Context manager collecting a Report for an operation on a file.
+
+    Operations started within another operation (e.g. loading the file that
+    is converted) are counted as part of the outer one. With emit_report
+    False the report is not passed to the hooks, e.g. to send it from a
+    worker process to the main process first.
+    '''
+    if current() is not None or not enabled:
+        return _NULL
+    return _Operation(Report(name, path), emit_report)
+
+
+def attach(report):
+    '''Context manager continuing an operation in another thread.'''
+    if report is None:
+        return _NULL
+    return _Operation(report, False)
+
+
+def phase(name):
+    '''Context manager timing a phase of the current operation.'''
+    report = current()
+    if report is None:
+        return _NULL
+    return _Phase(report, name)
+
+
+def count(counter, n=1):
+    report = current()
+    if report is not None:
+        report.count(counter, n)
+
+
+class _Reader(object):
+    def __init__(self, fd, report):
+        self.fd = fd
+        self.report = report
+
+    def read(self, size=-1):
+        with _Phase(self.report, 'read'):
+            data = self.fd.read(size)
+        self.report.count('bytes_read', len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fd, name)
+
+
+class _Writer(object):
+    def __init__(self, fd, report):
+        self.fd = fd
+        self.report = report
+
+    def write(self, data):
+        with _Phase(self.report, 'write'):
+            n = self.fd.write(data)
+        self.report.count('bytes_written', len(data))
+        return n
+
+    def writelines(self, chunks):
+        for data in chunks:
+            self.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.fd, name)
+
+
+def reader(fd):
+    '''Wraps a binary file object to time and count reads, if the instrumentation is enabled.'''
+    report = current()
+    return fd if report is None else _Reader(fd, report)
+
+
+def writer(fd):
+    '''Wraps a binary file object to time and count writes, if the instrumentation is enabled.'''
+    report = current()
+    return fd if report is None else _Writer(fd, report)
@@ -0,0 +1,388 @@
+#! /usr/bin/env python3
+
+'''Command line interface of MuseScoreTools for headless batch runs.
+
+Examples (run from the src directory):
+
+    python -m mst convert --remove-clefs --fix-key-sig --workers 4 'scores/**/*.mscz'
+    python -m mst merge book.mscz part1.mscz part2.mscz part3.mscz
+    python -m mst split book.mscz parts/
+    python -m mst export --remove-clefs book.mscz git/book.mscx dist/book.mscz
+    python -m mst batch jobs.json
+    python -m mst watch --remove-clefs --fix-key-sig /shared/scores
+    python -m mst validate 'scores/**/*.mscz'
+    python -m mst info 'scores/**/*.mscz'
+    python -m mst catalog scores.db /shared/scores
+    python -m mst merge --catalog scores.db --title 'Ave*' book.mscz
+
+A summary of all jobs with their timings is printed as JSON to stdout, for
+watch when it is stopped with Ctrl+C. Scores with timing issues count as
+failed jobs for validate, so it can be used as gate before merging.
+'''
+
+import os
+import csv
+import sys
+import glob
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import concurrent.futures
+
+import musescore
+import watch
+import catalog
+import validation
+
+
+logger = logging.getLogger('mst_cli')
+
+CONVERT_OPTIONS = ['copy_titles', 'remove_newlines', 'remove_clefs', 'add_section_break', 'fix_key_sig']
+
+QUERY_KEYS = ['title', 'meta', 'key_sig', 'time_sig', 'staff_count', 'directory', 'order']
+
+
+def expand_paths(patterns):
+    '''Expands glob patterns (including **) in order. Patterns without matches are kept as they are.'''
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        paths.extend(matches if matches else [pattern])
+    return paths
+
+
+def query_catalog(catalog_path, query):
+    '''Returns the files of a catalog matching a query, a dict with the arguments of Catalog.find().'''
+    unknown = set(query) - set(QUERY_KEYS)
+    if unknown:
+        raise ValueError('unknown query keys: {}'.format(', '.join(sorted(unknown))))
+    if not os.path.isfile(catalog_path):
+        raise ValueError('catalog not found: {}'.format(catalog_path))
+    with catalog.Catalog(catalog_path) as c:
+        return c.find(**query)
+
+
+def make_job(command, inputs, output=None, options=()):
+    if command not in ('convert', 'merge', 'split', 'validate', 'export'):
+        raise ValueError('unknown command: {}'.format(command))
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    unknown = set(options) - set(CONVERT_OPTIONS)
+    if unknown:
+        raise ValueError('unknown convert options: {}'.format(', '.join(sorted(unknown))))
+    if command in ('merge', 'split', 'export') and not output:
+        raise ValueError('{} job without output'.format(command))
+    if command == 'export' and isinstance(output, str):
+        output = [o.strip() for o in output.split(';') if o.strip()]
+    return {'command': command, 'input': expand_paths(inputs), 'output': output, 'options': list(options)}
+
+
+def load_jobs(path):
+    '''Loads jobs from a JSON or CSV file.
+
+    JSON files contain a list of objects with the keys command, input (path,
+    glob or list of them), output (a list for export) and options (list of
+    convert options).
+    Instead of or in addition to input, the keys catalog and query (object
+    with the arguments of Catalog.find()) select inputs from a catalog. CSV
+    files have the columns command, input, output and options, multiple
+    inputs and outputs are separated by ";" and multiple options by spaces.
+    '''
+    jobs = []
+    with open(path, encoding='utf8', newline='') as fd:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(fd):
+                inputs = [i.strip() for i in row['input'].split(';') if i.strip()]
+                jobs.append(make_job(row['command'].strip(), inputs, (row.get('output') or '').strip() or None,
+                                     (row.get('options') or '').split()))
+        else:
+            for entry in json.load(fd):
+                inputs = entry.get('input', [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                if 'query' in entry:
+                    inputs = inputs + query_catalog(entry['catalog'], entry['query'])
+                jobs.append(make_job(entry['command'], inputs, entry.get('output'), entry.get('options', ())))
+    return jobs
+
+
+def split_convert_jobs(jobs):
+    '''Splits convert and validate jobs into one job per file, so that files are distributed over the workers.'''
+    result = []
+    for job in jobs:
+        if job['command'] in ('convert', 'validate') and len(job['input']) > 1:
+            result.extend(dict(job, input=[f]) for f in job['input'])
+        else:
+            result.append(job)
+    return result
+
+
+def run_job(job):
+    '''Runs a single job and returns its result. Exceptions are reported in the result.'''
+    start = time.perf_counter()
+    result = dict(job, success=True, error=None)
+    try:
+        if job['command'] == 'convert':
+            plan = musescore.TransformPlan.from_options(**{o: True for o in job['options']})
+            for f in job['input']:
+                musescore.convert_file(f, plan)
+        elif job['command'] == 'merge':
+            musescore.merge_files(job['input'], job['output'])
+        elif job['command'] == 'split':
+            if len(job['input']) != 1:
+                raise musescore.MuseScoreException('split needs exactly one input file')
+            os.makedirs(job['output'], exist_ok=True)
+            result['parts'] = musescore.MuseScoreFile(job['input'][0]).split(job['output'])
+        elif job['command'] == 'export':
+            if len(job['input']) != 1:
+                raise musescore.MuseScoreException('export needs exactly one input file')
+            msf = musescore.MuseScoreFile(job['input'][0])
+            msf.apply(musescore.TransformPlan.from_options(**{o: True for o in job['options']}))
+            msf.write_many(job['output'])
+        elif job['command'] == 'validate':
+            result['issues'] = [issue._asdict() for f in job['input'] for issue in validation.validate_file(f)]
+            result['success'] = not result['issues']
+    except Exception as e:
+        result['success'] = False
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+def run_jobs(jobs, workers=None):
+    '''Runs jobs in a pool of worker processes and returns their results in order.'''
+    jobs = split_convert_jobs(jobs)
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def convert_results(results):
+    return [{'command': 'convert', 'input': [r.path], 'success': r.success, 'written': r.written,
+             'error': '{}: {}'.format(type(r.exception).__name__, r.exception) if r.exception else None,
+             'duration': r.duration} for r in results]
+
+
+def validation_results(results):
+    return [{'command': 'validate', 'input': [r.path], 'success': r.exception is None and not r.issues,
+             'error': '{}: {}'.format(type(r.exception).__name__, r.exception) if r.exception else None,
+             'issues': [issue._asdict() for issue in r.issues], 'duration': r.duration} for r in results]
+
+
+def info_result(path):
+    '''Probes the metadata of a file, see MuseScoreFile.probe().'''
+    start = time.perf_counter()
+    result = {'command': 'info', 'input': [path], 'success': True, 'error': None}
+    try:
+        result.update(musescore.MuseScoreFile.probe(path)._asdict())
+        del result['path']
+    except Exception as e:
+        result['success'] = False
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['duration'] = time.perf_counter() - start
+    return result
+
+
+def catalog_result(catalog_path, directories, workers=None, recursive=True):
+    start = time.perf_counter()
+    with catalog.Catalog(catalog_path) as c:
+        update = c.update(directories, workers, recursive)
+    return {'command': 'catalog', 'input': directories, 'output': catalog_path, 'success': True, 'error': None,
+            'added': update.added, 'updated': update.updated, 'unchanged': update.unchanged, 'removed': update.removed,
+            'unreadable': [{'path': path, 'error': error} for path, error in update.failed],
+            'duration': time.perf_counter() - start}
+
+
+def find_results(catalog_path, query):
+    paths = query_catalog(catalog_path, query)
+    with catalog.Catalog(catalog_path) as c:
+        entries = [c.entry(path) for path in paths]
+    results = []
+    for entry in entries:
+        result = {'command': 'find', 'input': [entry.pop('path')], 'success': True, 'error': None}
+        result.update(entry)
+        results.append(result)
+    return results
+
+
+def add_query_arguments(parser):
+    parser.add_argument('--title', help='title of a VBox, with the wildcards * and ?')
+    parser.add_argument('--meta', action='append', metavar='NAME=VALUE', help='value of a metaTag, with the wildcards * and ?')
+    parser.add_argument('--key-sig', type=int, help='key signature as number of accidentals, negative for flats')
+    parser.add_argument('--time-sig', help='time signature, e.g. 3/4')
+    parser.add_argument('--staffs', type=int, dest='staff_count', help='number of staffs')
+    parser.add_argument('--directory', help='directory containing the files, including its subdirectories')
+    parser.add_argument('--order', choices=['path', 'title'], default='path', help='order of the files (default: path)')
+
+
+def query_from_args(args):
+    query = {key: getattr(args, key) for key in ('title', 'key_sig', 'time_sig', 'staff_count', 'directory', 'order')
+             if getattr(args, key) is not None}
+    if args.meta:
+        query['meta'] = {}
+        for item in args.meta:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise ValueError('--meta needs NAME=VALUE: {}'.format(item))
+            query['meta'][name] = value
+    return query
+
+
+def select_inputs(args, patterns):
+    '''Returns the files given on the command line followed by the files selected from the catalog.'''
+    files = expand_paths(patterns)
+    if args.catalog:
+        files.extend(query_catalog(args.catalog, query_from_args(args)))
+    return files
+
+
+def summarize(results, wall_time):
+    return {
+        'jobs': len(results),
+        'succeeded': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success']),
+        'wall_time': wall_time,
+        'results': results,
+    }
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='mst', description='Converts, merges, splits and validates MuseScore files.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--summary', help='write the JSON summary to this file instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress to stderr')
+    parser.add_argument('--xml-backend', choices=['auto', 'lxml', 'etree'], help='XML library (default: lxml if installed)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert = subparsers.add_parser('convert', help='convert files in place')
+    convert.add_argument('files', nargs='+', help='files or glob patterns')
+    for option in CONVERT_OPTIONS:
+        convert.add_argument('--' + option.replace('_', '-'), action='store_true')
+    convert.add_argument('--incremental', metavar='MANIFEST', help='skip files unchanged since the run recorded in this manifest')
+    convert.add_argument('--sync', action='store_true', help='flush the written files to disk before exiting')
+
+    merge = subparsers.add_parser('merge', help='merge files into one')
+    merge.add_argument('output', help='output file (.mscx or .mscz)')
+    merge.add_argument('files', nargs='*', help='files or glob patterns, the first file is used as template')
+    merge.add_argument('--validate', action='store_true', help='only merge if no file has timing issues')
+    merge.add_argument('--catalog', metavar='DATABASE', help='merge the files of the catalog matching the query after the given files')
+    add_query_arguments(merge)
+
+    split = subparsers.add_parser('split', help='split a file at its VBoxes')
+    split.add_argument('input', nargs='?', help='input file')
+    split.add_argument('output_dir', help='output directory')
+    split.add_argument('--catalog', metavar='DATABASE', help='split the file of the catalog matching the query')
+    add_query_arguments(split)
+
+    export = subparsers.add_parser('export', help='convert a file and write it to several files at once')
+    export.add_argument('input', help='input file')
+    export.add_argument('outputs', nargs='+', help='output files (.mscx or .mscz)')
+    for option in CONVERT_OPTIONS:
+        export.add_argument('--' + option.replace('_', '-'), action='store_true')
+
+    batch = subparsers.add_parser('batch', help='run the jobs of a JSON or CSV file')
+    batch.add_argument('jobfile', help='JSON or CSV file with jobs')
+
+    watch_ = subparsers.add_parser('watch', help='convert scores as soon as they are added to or changed in a directory')
+    watch_.add_argument('directory', help='directory to watch')
+    for option in CONVERT_OPTIONS:
+        watch_.add_argument('--' + option.replace('_', '-'), action='store_true')
+    watch_.add_argument('--recursive', action='store_true', help='watch subdirectories too')
+    watch_.add_argument('--existing', action='store_true', help='convert the scores already in the directory')
+    watch_.add_argument('--interval', type=float, default=0.5, help='seconds between checks of the directory (default: 0.5)')
+    watch_.add_argument('--settle', type=float, default=1.0,
+                        help='seconds a file must be unchanged before it is converted (default: 1.0)')
+    watch_.add_argument('--incremental', metavar='MANIFEST', help='skip files unchanged since the run recorded in this manifest')
+
+    validate = subparsers.add_parser('validate', help='check measure durations, key and time signatures and clefs')
+    validate.add_argument('files', nargs='+', help='files or glob patterns')
+
+    info = subparsers.add_parser('info', help='show title, metadata and number of staffs without reading whole files')
+    info.add_argument('files', nargs='+', help='files or glob patterns')
+
+    catalog_ = subparsers.add_parser('catalog', help='add the scores of directories to a catalog or update it')
+    catalog_.add_argument('database', help='SQLite database of the catalog, created if it does not exist')
+    catalog_.add_argument('directories', nargs='+', help='directories with scores')
+    catalog_.add_argument('--flat', action='store_true', help='do not include subdirectories')
+
+    find = subparsers.add_parser('find', help='list the scores of a catalog matching a query')
+    find.add_argument('database', help='SQLite database of the catalog')
+    add_query_arguments(find)
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    start = time.perf_counter()
+    try:
+        if args.xml_backend:
+            musescore.set_xml_backend(args.xml_backend)
+            # inherited by the worker processes
+            os.environ['MST_XML_BACKEND'] = args.xml_backend
+        if args.command == 'convert':
+            options = {o: getattr(args, o) for o in CONVERT_OPTIONS}
+            files = expand_paths(args.files)
+            logger.info('Converting {} files'.format(len(files)))
+            results = convert_results(musescore.convert_files_parallel(files, workers=args.workers, manifest=args.incremental,
+                                                                              sync=args.sync, **options))
+        elif args.command == 'watch':
+            plan = musescore.TransformPlan.from_options(**{o: getattr(args, o) for o in CONVERT_OPTIONS})
+            watcher = watch.Watcher(args.directory, plan, args.workers, args.interval, args.settle, args.recursive,
+                                    args.existing, args.incremental)
+            try:
+                watcher.run()
+            except KeyboardInterrupt:
+                pass
+            results = convert_results(watcher.results)
+        elif args.command == 'validate':
+            files = expand_paths(args.files)
+            logger.info('Validating {} files'.format(len(files)))
+            results = validation_results(validation.validate_files(files, workers=args.workers))
+        elif args.command == 'info':
+            # probing takes milliseconds, a pool of workers would only slow it down
+            results = [info_result(f) for f in expand_paths(args.files)]
+        elif args.command == 'catalog':
+            results = [catalog_result(args.database, args.directories, args.workers, not args.flat)]
+        elif args.command == 'find':
+            results = find_results(args.database, query_from_args(args))
+        elif args.command == 'merge' and args.validate:
+            files = select_inputs(args, args.files)
+            results = validation_results(validation.validate_files(files, workers=args.workers))
+            if all(r['success'] for r in results):
+                results = run_jobs([make_job('merge', files, args.output)], 1)
+            else:
+                logger.error('Not merging, {} files have issues'.format(sum(1 for r in results if not r['success'])))
+        else:
+            if args.command == 'merge':
+                jobs = [make_job('merge', select_inputs(args, args.files), args.output)]
+            elif args.command == 'split':
+                jobs = [make_job('split', select_inputs(args, [args.input] if args.input else []), args.output_dir)]
+            elif args.command == 'export':
+                jobs = [make_job('export', args.input, args.outputs, [o for o in CONVERT_OPTIONS if getattr(args, o)])]
+            else:
+                jobs = load_jobs(args.jobfile)
+            logger.info('Running {} jobs'.format(len(jobs)))
+            results = run_jobs(jobs, args.workers)
+    except (ValueError, KeyError, OSError, sqlite3.Error, musescore.MuseScoreException) as e:
+        logger.error('{}: {}'.format(type(e).__name__, e))
+        return 2
+
+    summary = summarize(results, time.perf_counter() - start)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf8') as fd:
+            json.dump(summary, fd, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,31 @@
 
+import io
 import os
 import sys
+import array
 import copy
+import struct
+import time
+import json
+import logging
+import hashlib
+import zlib
+import threading
 import uuid
 import shutil
+import contextlib
 import zipfile
 import tempfile
+import itertools
+import collections
+import concurrent.futures
 import xml.etree.ElementTree as ET
 
+import instrumentation
+
+
+logger = logging.getLogger('musescore')
+
 
 class CapellaFile(object):
     pass
@@ -19,319 +37,1935 @@ class MuseScoreException(Exception):
     pass
 
 
-class MuseScoreFile(object):
-    def __init__(self, filepath):
-        self.filepath = filepath
-        _, ext = os.path.splitext(filepath)
-        if ext == '.mscx':
-            self.tree = MuseScoreFile.load_xml_file(filepath)
-        elif ext == '.mscz':
-            self.tree = MuseScoreFile.load_zip_file(filepath)
-        else:
-            raise MuseScoreException('invalid MuseScore file')
+def _text_of(element):
+    return ''.join(element.itertext())
 
 
-    @staticmethod
-    def _get_staff_element_from_tree(tree):
-        staff = tree.getroot().findall('Score/Staff')
-        if len(staff) != 1:
-            raise MuseScoreException('too many staffs (main)')
-        return staff[0]
+SCORE_EXTENSIONS = ('.mscx', '.mscz')
 
-    @staticmethod
-    def _get_staff_content_from_tree(tree):
-        staff = tree.getroot().findall('Score/Staff')
-        if len(staff) != 1:
-            raise MuseScoreException('too many staffs (content)')
-        return tree.getroot().findall('Score/Staff/*')
+_CONTENT_PLACEHOLDER = 'mst-content'
 
+# bytes of a staff kept in memory while merging scores with several staffs, see MuseScoreFile.merge_files()
+MERGE_BUFFER_SIZE = 16 * 1024 * 1024
 
-    def get_staff_element(self):
-        return MuseScoreFile._get_staff_element_from_tree(self.tree)
+# local file header of zip archives, see section 4.3.7 of the ZIP file format specification
+_LOCAL_FILE_HEADER = struct.Struct('<4s2B4HL2L2H')
 
+_XML_DECLARATION = "<?xml version='1.0' encoding='utf8'?>\n"
 
-    def get_staff_content(self):
-        return MuseScoreFile._get_staff_content_from_tree(self.tree)
+# ElementTree sorted attributes by name before Python 3.8
+_SORT_ATTRIBUTES = sys.version_info < (3, 8)
 
 
-    def remove_clefs(self):
-        clef_parents = self.tree.getroot().findall('Score/Staff/Measure/voice/Clef/..')
-        for parent in clef_parents:
-            clef = parent.find('Clef')
-            parent.remove(clef)
+class _EtreeBackend(object):
+    '''XML backend using xml.etree.ElementTree of the standard library.'''
+    name = 'etree'
 
+    def __init__(self):
+        self.etree = ET
+        self.ParseError = ET.ParseError
 
-    def remove_newlines(self):
-        measures = self.tree.getroot().findall('''Score/Staff/Measure/LayoutBreak/subtype/[.='line']/../..''')
-        for measure in measures:
-            newline = measure.find('LayoutBreak')
-            measure.remove(newline)
+    def parse(self, fd):
+        return ET.parse(fd, parser=ET.XMLParser(encoding='utf-8'))
 
+    def iterparse(self, fd):
+        # the encoding is given like for parse(), expat does not know the utf8 written into the declaration
+        return ET.iterparse(fd, events=('start', 'end'), parser=ET.XMLParser(encoding='utf-8'))
 
-    def add_sectionbreak(self):
-        # find last measure
-        lastmeasure = self.tree.getroot().findall('Score/Staff/Measure[last()]')
-        lastmeasure = lastmeasure[0]
+    def element_tree(self, root):
+        return ET.ElementTree(root)
 
-        # check if section break exists
-        sectionbreak = lastmeasure.find('''LayoutBreak/subtype/[.='section']''')
-        if sectionbreak:
-            return
+    def tostring(self, elem):
+        return _tostring(elem)
 
-        # add section break
-        layoutbreak = ET.SubElement(lastmeasure, 'LayoutBreak')
-        subtype = ET.SubElement(layoutbreak, 'subtype')
-        subtype.text = 'section'
+    def write(self, tree, fd):
+        _write_xml(tree, fd)
 
 
-    def set_text_as_title(self):
+class _LxmlBackend(object):
+    '''XML backend using lxml.etree, which parses faster.
+
+    Comments and processing instructions are dropped like ElementTree does.
+    '''
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree
+        self.etree = etree
+        self.ParseError = etree.ParseError
+
+    def parse(self, fd):
+        # parsers must not be shared between threads
+        parser = self.etree.XMLParser(encoding='utf-8', remove_comments=True, remove_pis=True, resolve_entities=False)
+        return self.etree.parse(fd, parser)
+
+    def iterparse(self, fd):
+        return self.etree.iterparse(fd, events=('start', 'end'), remove_comments=True, remove_pis=True, resolve_entities=False)
+
+    def element_tree(self, root):
+        return root.getroottree()
+
+    def tostring(self, elem):
+        if _SORT_ATTRIBUTES:
+            return _tostring(elem)
+        # libxml2 serializes much faster, its output only differs from ElementTree in the
+        # space before '/>' ('>' is always escaped in text) and in escaping tabs and
+        # carriage returns, for which the slower exact serializer is used
+        data = self.etree.tostring(elem, encoding='utf8', xml_declaration=False).replace(b'/>', b' />')
+        if b'&#9;' in data or b'&#13;' in data:
+            return _tostring(elem)
+        return data
+
+    def write(self, tree, fd):
+        fd.write(_XML_DECLARATION.encode('utf8'))
+        fd.write(self.tostring(tree.getroot()))
+
+
+_backend = None
+
+
+def set_xml_backend(name='auto'):
+    '''Selects the XML library used to load scores: 'lxml', 'etree' or 'auto' (lxml if installed).
+
+    The default can be set with the environment variable MST_XML_BACKEND. Both
+    backends write identical files. Trees of different backends must not be
+    mixed, so the backend should be selected before any score is loaded.
+    '''
+    global _backend
+    if name == 'auto':
+        try:
+            _backend = _LxmlBackend()
+        except ImportError:
+            _backend = _EtreeBackend()
+    elif name == 'lxml':
+        try:
+            _backend = _LxmlBackend()
+        except ImportError:
+            raise MuseScoreException('XML backend lxml is not installed')
+    elif name == 'etree':
+        _backend = _EtreeBackend()
+    else:
+        raise MuseScoreException('unknown XML backend: {}'.format(name))
+
+
+def get_xml_backend():
+    return _backend.name
+
+
+set_xml_backend(os.environ.get('MST_XML_BACKEND', 'auto'))
+
+
+def _sub_element(parent, tag, text=None):
+    # makeelement() creates elements of the backend the parent belongs to
+    element = parent.makeelement(tag, {})
+    if text:
+        # lxml would write an empty text as <tag></tag>
+        element.text = text
+    parent.append(element)
+    return element
+
+
+def _serialize(elem, chunks, hidden=None, flush=None):
+    '''Appends the XML of an element to chunks, formatted exactly like ElementTree.write() does.
+
+    Works for the trees of all backends and is faster than ElementTree's own
+    serializer, namespaces are not supported. The content of the elements in
+    hidden is replaced by a placeholder. flush is called from time to time to
+    write out the collected chunks.
+    '''
+    write = chunks.append
+    tag = elem.tag
+    if not isinstance(tag, str):
+        raise MuseScoreException('unsupported XML node: {!r}'.format(elem))
+    write('<' + tag)
+    items = elem.items()
+    if items:
+        if _SORT_ATTRIBUTES:
+            items = sorted(items)
+        for k, v in items:
+            write(' {}="{}"'.format(k, ET._escape_attrib(v)))
+    text = elem.text
+    if hidden is not None and elem in hidden:
+        write('>')
+        if text:
+            write(ET._escape_cdata(text))
+        write('<{} /></{}>'.format(_CONTENT_PLACEHOLDER, tag))
+    elif text or len(elem):
+        write('>')
+        if text:
+            write(ET._escape_cdata(text))
+        for e in elem:
+            _serialize(e, chunks, hidden, flush)
+        write('</' + tag + '>')
+    else:
+        write(' />')
+    if elem.tail:
+        write(ET._escape_cdata(elem.tail))
+    if flush is not None and len(chunks) > 65536:
+        flush()
+
+
+def _tostring(elem):
+    chunks = []
+    _serialize(elem, chunks)
+    return ''.join(chunks).encode('utf8')
+
+
+def _write_xml(tree, fd):
+    '''Writes a tree with XML declaration to a binary file object.'''
+    chunks = [_XML_DECLARATION]
+
+    def flush():
+        fd.write(''.join(chunks).encode('utf8'))
+        del chunks[:]
+
+    _serialize(tree.getroot(), chunks, flush=flush)
+    flush()
+
+
+class Transform(object):
+    '''Base class for transforms applied by a TransformPlan.
+
+    The plan walks Score/Staff once and calls the visit methods of all its
+    transforms for every staff, VBox, measure and voice. Changes that need to
+    know the whole score have to be done in finish(). Transforms set changed
+    when they modify the score.
+    '''
+    changed = False
+
+    def visit_staff(self, staff):
+        pass
+
+    def visit_vbox(self, staff, vbox):
+        pass
+
+    def visit_measure(self, staff, measure):
+        pass
+
+    def visit_voice(self, staff, measure, voice):
+        pass
+
+    def finish(self, tree):
+        pass
+
+
+class SetTextAsTitle(Transform):
+    '''Moves the only staff text of a score into the subtitle of its VBox.'''
+    def __init__(self):
+        self.staff = None
+        self.vboxs = []
+        self.texts = []
+
+    def visit_staff(self, staff):
+        if self.staff is None:
+            self.staff = staff
+
+    def visit_vbox(self, staff, vbox):
+        self.vboxs.append(vbox)
+
+    def visit_voice(self, staff, measure, voice):
+        for stafftext in voice.iterfind('StaffText'):
+            for text in stafftext.iterfind('text'):
+                self.texts.append((voice, stafftext, text))
+
+    def finish(self, tree):
         # find target title text
-        texts = self.tree.getroot().findall('Score/Staff/Measure/voice/StaffText/text')
-        if len(texts) != 1:
+        if len(self.texts) != 1:
             # TODO: get warning to gui
-            print('set_text_as_title failed - too many texts')
+            logger.warning('set_text_as_title failed - too many texts')
             return
-        title = texts[0].text
+        voice, stafftext, text = self.texts[0]
+        title = text.text
 
-        # find vboxs
-        vboxs = self.tree.getroot().findall('Score/Staff/VBox')
-        if len(vboxs) > 1:
+        # find vbox
+        if len(self.vboxs) > 1:
             # TODO: get warning to gui
-            print('set_text_as_title failed - too many vboxs')
+            logger.warning('set_text_as_title failed - too many vboxs')
             return
-        elif len(vboxs) == 0:
-            staff = self.tree.getroot().findall('Score/Staff')[0]
-            vbox = ET.Element('VBox')
-            height = ET.SubElement(vbox, 'height')
-            height.text = '4'
-            staff.insert(0, vbox)
+        elif len(self.vboxs) == 0:
+            vbox = self.staff.makeelement('VBox', {})
+            _sub_element(vbox, 'height', '4')
+            self.staff.insert(0, vbox)
+            self.changed = True
         else:
-            vbox = vboxs[0]
+            vbox = self.vboxs[0]
 
         # add title to vbox
-        subtitles = vbox.findall('''Text/style/[.='Subtitle']/..''')
+        subtitles = [t for t in vbox.iterfind('Text') if any(_text_of(s) == 'Subtitle' for s in t.iterfind('style'))]
         if len(subtitles) == 1:
             subtitles[0].find('text').text = title
         elif len(subtitles) == 0:
-            textel = ET.SubElement(vbox, 'Text')
-            style = ET.SubElement(textel, 'style')
-            style.text = 'Subtitle'
-            text = ET.SubElement(textel, 'text')
-            text.text = title
+            textel = _sub_element(vbox, 'Text')
+            _sub_element(textel, 'style', 'Subtitle')
+            _sub_element(textel, 'text', title)
         else:
             # TODO: get warning to gui
-            print('set_text_as_title failed - too many subtitles')
+            logger.warning('set_text_as_title failed - too many subtitles')
             return
 
         # remove text
-        stafftext = self.tree.getroot().findall('Score/Staff/Measure/voice/StaffText/text/..')[0]
-        voice = self.tree.getroot().findall('Score/Staff/Measure/voice/StaffText/text/../..')[0]
         voice.remove(stafftext)
+        self.changed = True
+
+
+class RemoveNewlines(Transform):
+    '''Removes line breaks from all measures.'''
+    def visit_measure(self, staff, measure):
+        for layoutbreak in measure.iterfind('LayoutBreak'):
+            if any(_text_of(s) == 'line' for s in layoutbreak.iterfind('subtype')):
+                measure.remove(measure.find('LayoutBreak'))
+                self.changed = True
+                break
+
+
+class RemoveClefs(Transform):
+    '''Removes clef changes from all voices.'''
+    def visit_voice(self, staff, measure, voice):
+        clef = voice.find('Clef')
+        if clef is not None:
+            voice.remove(clef)
+            self.changed = True
+
+
+class AddSectionBreak(Transform):
+    '''Adds a section break to the last measure of the score.'''
+    def __init__(self):
+        self.staff = None
+        self.lastmeasure = None
+
+    def visit_measure(self, staff, measure):
+        if self.staff is None:
+            self.staff = staff
+        if staff is self.staff:
+            self.lastmeasure = measure
+
+    def finish(self, tree):
+        if self.lastmeasure is None:
+            raise MuseScoreException('no measures found')
+
+        # check if section break exists
+        for layoutbreak in self.lastmeasure.iterfind('LayoutBreak'):
+            if any(_text_of(s) == 'section' for s in layoutbreak.iterfind('subtype')):
+                return
+
+        # add section break
+        layoutbreak = _sub_element(self.lastmeasure, 'LayoutBreak')
+        _sub_element(layoutbreak, 'subtype', 'section')
+        self.changed = True
+
+
+class FixKeySig(Transform):
+    '''Adds a C major key signature if the first measures have none.'''
+    def __init__(self):
+        self.staff = None
+        self.voice = None
+        self.key_sig = False
+
+    def visit_measure(self, staff, measure):
+        # only the first measure of every staff is checked
+        if staff is self.staff:
+            return
+        self.staff = staff
+        for voice in measure.iterfind('voice'):
+            if self.voice is None:
+                self.voice = voice
+            if voice.find('KeySig') is not None:
+                self.key_sig = True
+
+    def finish(self, tree):
+        if self.key_sig:
+            return
+        if self.voice is None:
+            raise MuseScoreException('no voice found in first measure')
+        key_sig = self.voice.makeelement('KeySig', {})
+        _sub_element(key_sig, 'accidental', '0')
+        self.voice.insert(0, key_sig)
+        self.changed = True
+
+
+class TransformPlan(object):
+    '''Ordered selection of transforms that can be applied to any number of scores.
+
+    All transforms of a plan are applied in a single traversal of the score. A
+    plan only holds the transform classes, so it can be reused across files.
+    '''
+    def __init__(self, transforms=()):
+        self.transforms = tuple(transforms)
+
+    @classmethod
+    def from_options(cls, copy_titles=False, remove_newlines=False, remove_clefs=False, add_section_break=False, fix_key_sig=False):
+        transforms = []
+        if copy_titles:
+            transforms.append(SetTextAsTitle)
+        if remove_newlines:
+            transforms.append(RemoveNewlines)
+        if remove_clefs:
+            transforms.append(RemoveClefs)
+        if add_section_break:
+            transforms.append(AddSectionBreak)
+        if fix_key_sig:
+            transforms.append(FixKeySig)
+        return cls(transforms)
+
+    def __len__(self):
+        return len(self.transforms)
 
+    def names(self):
+        return [t.__name__ for t in self.transforms]
+
+    @staticmethod
+    def _hooks(transforms, name):
+        default = getattr(Transform, name)
+        return [getattr(t, name) for t in transforms if getattr(type(t), name) is not default]
+
+    def apply(self, tree):
+        '''Applies all transforms to the tree and returns whether it was changed.'''
+        transforms = [t() for t in self.transforms]
+        staff_hooks = self._hooks(transforms, 'visit_staff')
+        vbox_hooks = self._hooks(transforms, 'visit_vbox')
+        measure_hooks = self._hooks(transforms, 'visit_measure')
+        voice_hooks = self._hooks(transforms, 'visit_voice')
+
+        elements = measures = 0
+        for staff in tree.getroot().findall('Score/Staff'):
+            for hook in staff_hooks:
+                hook(staff)
+            children = list(staff)
+            elements += len(children)
+            for element in children:
+                if element.tag == 'Measure':
+                    measures += 1
+                    for hook in measure_hooks:
+                        hook(staff, element)
+                    if voice_hooks:
+                        for voice in element.findall('voice'):
+                            for hook in voice_hooks:
+                                hook(staff, element, voice)
+                elif element.tag == 'VBox':
+                    for hook in vbox_hooks:
+                        hook(staff, element)
+
+        for t in transforms:
+            t.finish(tree)
+        instrumentation.count('elements', elements)
+        instrumentation.count('measures', measures)
+        return any(t.changed for t in transforms)
+
+
+def _find_titles(vbox):
+    return [text for t in vbox.iterfind('Text') if any(_text_of(s) == 'Title' for s in t.iterfind('style'))
+            for text in t.iterfind('text')]
+
+
+class ScoreIndex(object):
+    '''Lookup tables for the structure of Score/Staff, built in a single pass over the tree.
+
+    Holds the measures of every staff, VBoxes with their title texts and the
+    TimeSig elements of all voices. An index is only valid until the tree is
+    changed.
+    '''
+    def __init__(self, tree):
+        self.measures = []
+        self.vboxes = []
+        self.titles = {}
+        self.time_sigs = []
+
+        for staff in tree.getroot().iterfind('Score/Staff'):
+            measures = []
+            for element in staff:
+                if element.tag == 'Measure':
+                    measures.append(element)
+                    for voice in element.iterfind('voice'):
+                        self.time_sigs.extend(voice.iterfind('TimeSig'))
+                elif element.tag == 'VBox':
+                    self.vboxes.append(element)
+                    self.titles[element] = _find_titles(element)
+            self.measures.append(measures)
+
+
+def _int_of(element, path, default):
+    try:
+        return int(element.findtext(path, default))
+    except ValueError:
+        return default
+
+
+class CompactScore(object):
+    '''Read-only outline of the measures of a score for analysis, without an element tree.
+
+    For every staff the number of voices and a bit set of the markers in
+    each measure (TIME_SIG, KEY_SIG, ...) are kept in flat arrays indexed by
+    the ordinal of the measure, as well as the accidentals of key signatures
+    (NO_KEY_SIG in measures without one) and numerator and denominator of
+    time signatures (0 without one). VBoxes of the first staff are stored with
+    the ordinal of the following measure and their title texts. A measure
+    takes 7 bytes, so outlines of many scores can be held at once. Key
+    signatures outside of -7 to 7 accidentals and time signatures that do not
+    fit into 16 bits raise a MuseScoreException.
+    '''
+    TIME_SIG = 1
+    KEY_SIG = 2
+    CLEF = 4
+    STAFF_TEXT = 8
+    LINE_BREAK = 16
+    PAGE_BREAK = 32
+    SECTION_BREAK = 64
+    NO_KEY_SIG = -128
+
+    _MARKERS = {'TimeSig': TIME_SIG, 'KeySig': KEY_SIG, 'Clef': CLEF, 'StaffText': STAFF_TEXT}
+    _BREAKS = {'line': LINE_BREAK, 'page': PAGE_BREAK, 'section': SECTION_BREAK}
+
+    __slots__ = ('voices', 'markers', 'key_sigs', 'time_sig_n', 'time_sig_d', 'vbox_positions', 'vbox_texts',
+                 'staff_texts', 'all_markers')
+
+    def __init__(self, content):
+        '''Builds the outline from (staff index, element) pairs of the staff content, see MuseScoreFile.iter_staff_content().'''
+        self.voices = []
+        self.markers = []
+        self.key_sigs = []
+        self.time_sig_n = []
+        self.time_sig_d = []
+        self.vbox_positions = array.array('l')
+        self.vbox_texts = []
+        self.staff_texts = []
+        self.all_markers = 0
+        for staff_index, e in content:
+            while len(self.voices) <= staff_index:
+                self.voices.append(array.array('B'))
+                self.markers.append(array.array('B'))
+                self.key_sigs.append(array.array('b'))
+                self.time_sig_n.append(array.array('H'))
+                self.time_sig_d.append(array.array('H'))
+            if e.tag == 'Measure':
+                self._add_measure(staff_index, e)
+            elif e.tag == 'VBox' and staff_index == 0:
+                self.vbox_positions.append(len(self.voices[0]))
+                self.vbox_texts.append(tuple(text.text for text in _find_titles(e)))
+
+    def _add_measure(self, staff_index, measure):
+        voices = 0
+        markers = 0
+        key_sig = self.NO_KEY_SIG
+        sig_n = sig_d = 0
+        for child in measure:
+            if child.tag == 'voice':
+                voices += 1
+                for e in child:
+                    marker = self._MARKERS.get(e.tag)
+                    if marker is None:
+                        continue
+                    markers |= marker
+                    if marker == self.KEY_SIG:
+                        key_sig = _int_of(e, 'accidental', 0)
+                        if not -7 <= key_sig <= 7:
+                            raise MuseScoreException('invalid key signature in measure {} of staff {}: {} accidentals'.format(
+                                len(self.voices[staff_index]) + 1, staff_index + 1, key_sig))
+                    elif marker == self.TIME_SIG:
+                        sig_n = _int_of(e, 'sigN', 0)
+                        sig_d = _int_of(e, 'sigD', 0)
+                        if not (0 <= sig_n <= 0xffff and 0 <= sig_d <= 0xffff):
+                            raise MuseScoreException('invalid time signature in measure {} of staff {}: {}/{}'.format(
+                                len(self.voices[staff_index]) + 1, staff_index + 1, sig_n, sig_d))
+                    elif marker == self.STAFF_TEXT:
+                        self.staff_texts.append((staff_index, len(self.voices[staff_index]), e.findtext('text')))
+            elif child.tag == 'LayoutBreak':
+                for subtype in child.iterfind('subtype'):
+                    markers |= self._BREAKS.get(_text_of(subtype), 0)
+        self.voices[staff_index].append(min(voices, 255))
+        self.markers[staff_index].append(markers)
+        self.key_sigs[staff_index].append(key_sig)
+        self.time_sig_n[staff_index].append(sig_n)
+        self.time_sig_d[staff_index].append(sig_d)
+        self.all_markers |= markers
+
+    @classmethod
+    def load(cls, filepath):
+        '''Builds the outline of a .mscx or .mscz file in a single streaming pass.'''
+        with instrumentation.operation('outline', filepath), instrumentation.phase('parse'):
+            return cls(MuseScoreFile.iter_staff_content(filepath))
+
+    @classmethod
+    def from_tree(cls, tree):
+        return cls((i, e) for i, staff in enumerate(tree.getroot().iterfind('Score/Staff')) for e in staff)
+
+    @property
+    def staff_count(self):
+        return len(self.voices)
+
+    def measure_count(self, staff_index=0):
+        return len(self.voices[staff_index]) if staff_index < len(self.voices) else 0
 
     def contains_time_sig(self):
-        time_sig = self.tree.getroot().findall('Score/Staff/Measure/voice/TimeSig')
-        if time_sig:
+        return bool(self.all_markers & self.TIME_SIG)
+
+    def measures_with(self, marker, staff_index=0):
+        '''Returns the ordinals of the measures of a staff that contain the given markers.'''
+        if staff_index >= len(self.markers):
+            return []
+        return [i for i, m in enumerate(self.markers[staff_index]) if m & marker]
+
+    def vbox_titles(self):
+        '''Returns the title of every VBox like split() names the parts, None if it has not exactly one title.'''
+        return [texts[0] if len(texts) == 1 else None for texts in self.vbox_texts]
+
+
+def clone_tree(tree):
+    '''Returns a deep copy of an ElementTree. Faster than copy.deepcopy(), because strings are shared.'''
+    def clone(e):
+        c = e.makeelement(e.tag, e.attrib)
+        c.text = e.text
+        c.tail = e.tail
+        c[:] = [clone(child) for child in e]
+        return c
+    return _backend.element_tree(clone(tree.getroot()))
+
+
+class ScoreCache(object):
+    '''In-memory LRU cache of parsed scores.
+
+    Entries are keyed by path, modification time and size of a file, or by a
+    hash of its content if hash_content is set. Least recently used entries
+    are evicted once the total size of the cached scores (measured as
+    uncompressed XML) exceeds max_bytes.
+
+    Cached trees are shared between all users. load() returns a clone unless
+    clone=False is given, MuseScoreFile uses the shared tree and clones it
+    before the first change (copy-on-write).
+    '''
+    def __init__(self, max_bytes=256 * 1024 * 1024, hash_content=False):
+        self.max_bytes = max_bytes
+        self.hash_content = hash_content
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, filepath):
+        if self.hash_content:
+            with open(filepath, 'rb') as fd:
+                return hashlib.sha1(fd.read()).hexdigest()
+        st = os.stat(filepath)
+        return (os.path.abspath(filepath), st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _score_size(filepath):
+        _, ext = os.path.splitext(filepath)
+        if ext == '.mscz':
+            with zipfile.ZipFile(filepath, 'r') as archive:
+                return archive.getinfo(MuseScoreFile._get_rootfile(archive)).file_size
+        return os.path.getsize(filepath)
+
+    def _add(self, key, tree, size):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (tree, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def load(self, filepath, clone=True):
+        key = self._key(filepath)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            tree = MuseScoreFile.load_file(filepath)
+            with self._lock:
+                self.misses += 1
+            self._add(key, tree, self._score_size(filepath))
+        else:
+            tree = entry[0]
+        return clone_tree(tree) if clone else tree
+
+    def store(self, filepath, tree):
+        '''Adds the tree of a file that was just written. The cache takes ownership of the tree.'''
+        self._add(self._key(filepath), tree, self._score_size(filepath))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def _zip_info(name, compression, compresslevel=None):
+    '''Returns the ZipInfo of a new archive entry, dated now like ZipFile.write() dates a file by its mtime.'''
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compression
+    # as set by ZipFile.open() for entries given by name
+    info._compresslevel = compresslevel
+    info.external_attr = 0o600 << 16
+    return info
+
+
+def _fsync(path):
+    # Windows can only flush files opened for writing
+    fd = os.open(path, os.O_RDWR if os.name == 'nt' else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(directory):
+    # makes a replaced file durable, directories cannot be opened on Windows
+    if os.name == 'nt':
+        return
+    fd = os.open(directory or os.curdir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SyncBatch(object):
+    '''Flushes written files to disk together instead of one after another.
+
+    Pass it as sync to MuseScoreFile.write() or convert_file(). The files
+    replace their old versions right away, sync() or the end of a with block
+    waits until all of them and their directories are on disk. This is much
+    faster for many files, but files written since the last sync() may be
+    incomplete after a power failure.
+    '''
+    def __init__(self):
+        self.paths = []
+
+    def add(self, path):
+        self.paths.append(path)
+
+    def sync(self):
+        paths, self.paths = self.paths, []
+        with instrumentation.phase('sync'):
+            for path in paths:
+                _fsync(path)
+            for directory in set(os.path.dirname(path) for path in paths):
+                _fsync_directory(directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sync()
+        return False
+
+
+def _backup(path):
+    backup_path = path + '~'
+    try:
+        os.remove(backup_path)
+    except FileNotFoundError:
+        pass
+    try:
+        # the backup keeps the old data, because the file is replaced and not overwritten
+        os.link(path, backup_path)
+    except OSError:
+        # file systems without hard links, e.g. FAT
+        os.replace(path, backup_path)
+
+
+@contextlib.contextmanager
+def _replace_file(outpath, backup=False, sync=None):
+    '''Yields a temporary path next to outpath, the file written there replaces outpath if the block succeeds.
+
+    An interrupted write leaves outpath untouched. The temporary file starts
+    with a dot and ends with .tmp, so it is not taken for a score. With
+    backup the old file is kept as outpath + '~'. sync is True to flush the
+    file to disk before it replaces outpath, or a SyncBatch.
+    '''
+    if os.path.islink(outpath):
+        outpath = os.path.realpath(outpath)
+    directory, name = os.path.split(outpath)
+    temppath = os.path.join(directory, '.{}.{}.tmp'.format(name, uuid.uuid4().hex[:8]))
+    try:
+        yield temppath
+        if sync is True:
+            with instrumentation.phase('sync'):
+                _fsync(temppath)
+        if os.path.exists(outpath):
+            shutil.copymode(outpath, temppath)
+            if backup:
+                with instrumentation.phase('copy'):
+                    _backup(outpath)
+        os.replace(temppath, outpath)
+    except BaseException:
+        try:
+            os.remove(temppath)
+        except OSError:
+            pass
+        raise
+    if sync is True:
+        with instrumentation.phase('sync'):
+            _fsync_directory(directory)
+    elif sync:
+        sync.add(outpath)
+
+
+ScoreInfo = collections.namedtuple('ScoreInfo', ['path', 'version', 'meta_tags', 'title', 'staff_count'])
+
+PROBE_FIELDS = ('meta_tags', 'title', 'staff_count')
+
+
+class MuseScoreFile(object):
+    def __init__(self, filepath, cache=None):
+        '''Loads a score, optionally through a ScoreCache.'''
+        self.filepath = filepath
+        self._shared = cache is not None
+        self._index = None
+        # entries besides the score (thumbnails, images, audio...) are copied from here on write
+        self.source_archive = filepath if os.path.splitext(filepath)[1] == '.mscz' else None
+        self._cache = cache
+        self._tree = None
+
+
+    @property
+    def tree(self):
+        '''ElementTree of the score, loaded on first use.'''
+        if self._tree is None:
+            if self._cache is not None:
+                self._tree = self._cache.load(self.filepath, clone=False)
+            else:
+                self._tree = MuseScoreFile.load_file(self.filepath)
+        return self._tree
+
+
+    @tree.setter
+    def tree(self, tree):
+        self._tree = tree
+        # the index belongs to the old tree, a tree set from outside is not shared with a cache
+        self._index = None
+        self._shared = False
+
+
+    @property
+    def index(self):
+        '''ScoreIndex of the tree, built on first use and dropped when the tree is changed.'''
+        if self._index is None:
+            with instrumentation.phase('index'):
+                self._index = ScoreIndex(self.tree)
+        return self._index
+
+
+    @staticmethod
+    def load_file(filepath):
+        _, ext = os.path.splitext(filepath)
+        with instrumentation.operation('load', filepath):
+            if ext == '.mscx':
+                return MuseScoreFile.load_xml_file(filepath)
+            elif ext == '.mscz':
+                return MuseScoreFile.load_zip_file(filepath)
+            else:
+                raise MuseScoreException('invalid MuseScore file')
+
+
+    @staticmethod
+    def _get_staffs_from_tree(tree):
+        staffs = tree.getroot().findall('Score/Staff')
+        if not staffs:
+            raise MuseScoreException('no staffs found')
+        return staffs
+
+    @staticmethod
+    def _get_staff_contents_from_tree(tree):
+        return [list(staff) for staff in MuseScoreFile._get_staffs_from_tree(tree)]
+
+
+    def get_staff_element(self, staff_index=0):
+        return MuseScoreFile._get_staffs_from_tree(self.tree)[staff_index]
+
+
+    def get_staff_content(self, staff_index=0):
+        return list(self.get_staff_element(staff_index))
+
+
+    def get_staff_contents(self):
+        '''Returns the content of all staffs as lists of elements.'''
+        return MuseScoreFile._get_staff_contents_from_tree(self.tree)
+
+
+    def apply(self, plan):
+        if self._shared:
+            # copy-on-write for trees shared with a ScoreCache
+            with instrumentation.phase('clone'):
+                self.tree = clone_tree(self.tree)
+        with instrumentation.phase('transform'):
+            changed = plan.apply(self.tree)
+        if changed:
+            self._index = None
+        return changed
+
+
+    def remove_clefs(self):
+        self.apply(TransformPlan([RemoveClefs]))
+
+
+    def remove_newlines(self):
+        self.apply(TransformPlan([RemoveNewlines]))
+
+
+    def add_sectionbreak(self):
+        self.apply(TransformPlan([AddSectionBreak]))
+
+
+    def set_text_as_title(self):
+        self.apply(TransformPlan([SetTextAsTitle]))
+
+
+    def contains_time_sig(self):
+        if self._tree is None and self._cache is None:
+            # nothing loaded yet, the file is only read up to the first time signature
+            return MuseScoreFile.file_contains_time_sig(self.filepath)
+        if self.index.time_sigs:
             return True
         else:
             return False
 
 
     def fix_key_sig(self):
-        time_sig = self.tree.getroot().findall('Score/Staff/Measure[1]/voice/KeySig')
-        if not time_sig:
-            voice_root = self.tree.getroot().findall('Score/Staff/Measure[1]/voice')[0]
-            key_sig = ET.Element('KeySig')
-            accidental = ET.SubElement(key_sig, 'accidental')
-            accidental.text = '0'
-            voice_root.insert(0, key_sig)
+        self.apply(TransformPlan([FixKeySig]))
+
+
+    @staticmethod
+    def _open_zip_file(outpath, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+        # compresslevel is only supported by Python 3.7 and newer
+        if compresslevel is None:
+            return zipfile.ZipFile(outpath, 'w', compression)
+        return zipfile.ZipFile(outpath, 'w', compression, compresslevel=compresslevel)
+
+
+    @staticmethod
+    def _entry_info(archive, name):
+        # compresslevel is only supported by Python 3.7 and newer
+        return _zip_info(name, archive.compression, getattr(archive, 'compresslevel', None))
+
+
+    @staticmethod
+    def _write_container(archive, rootfile):
+        croot = ET.Element('container')
+        crootfiles = ET.SubElement(croot, 'rootfiles')
+        crootfile = ET.SubElement(crootfiles, 'rootfile', attrib={'full-path': rootfile})
+        ctree = ET.ElementTree(croot)
+        with archive.open(MuseScoreFile._entry_info(archive, 'META-INF/container.xml'), 'w') as fd:
+            ctree.write(fd, encoding='utf8')
 
 
     @staticmethod
-    def _write_tree(tree, outpath):
+    def _read_raw_entries(archive_path):
+        '''Reads all entries of an archive besides the score without decompressing them.
+
+        Returns the name of the score and a list of (ZipInfo, compressed data)
+        in archive order, the data of the score entry is None.
+        '''
+        entries = []
+        with open(archive_path, 'rb') as fd:
+            with zipfile.ZipFile(fd, 'r') as archive:
+                rootfile = MuseScoreFile._get_rootfile(archive)
+                infos = archive.infolist()
+            for info in infos:
+                if info.filename == rootfile:
+                    entries.append((info, None))
+                    continue
+                fd.seek(info.header_offset)
+                header = fd.read(_LOCAL_FILE_HEADER.size)
+                if len(header) != _LOCAL_FILE_HEADER.size or header[:4] != b'PK\x03\x04':
+                    raise MuseScoreException('Could not read archive entry: {}'.format(info.filename))
+                fields = _LOCAL_FILE_HEADER.unpack(header)
+                fd.seek(fields[10] + fields[11], os.SEEK_CUR)
+                entries.append((info, fd.read(info.compress_size)))
+        return rootfile, entries
+
+
+    @staticmethod
+    def _write_raw_entry(archive, info, data):
+        # zipfile has no public API to add already compressed data, so the
+        # entry is written like ZipFile.writestr() does it internally
+        zinfo = copy.copy(info)
+        zinfo.flag_bits &= ~0x08    # sizes are known, no data descriptor follows
+        zinfo.header_offset = archive.fp.tell()
+        archive.fp.write(zinfo.FileHeader())
+        archive.fp.write(data)
+        archive.start_dir = archive.fp.tell()
+        archive.filelist.append(zinfo)
+        archive.NameToInfo[zinfo.filename] = zinfo
+        archive._didModify = True
+
+
+    @staticmethod
+    def _serialize_tree(tree, fd):
+        with instrumentation.phase('serialize'):
+            _backend.write(tree, instrumentation.writer(fd))
+
+
+    @staticmethod
+    def _write_tree(tree, outpath, compression=zipfile.ZIP_DEFLATED, compresslevel=None, source_archive=None,
+                    backup=False, sync=None):
         _, ext = os.path.splitext(outpath)
-        if ext == '.mscx':
-            tree.write(outpath, encoding='utf8')
-        elif ext == '.mscz':
-            with tempfile.TemporaryDirectory() as tempdir:
-                # determine paths
-                scorepath = os.path.join(tempdir, 'score.mscx')
-                metapath = os.path.join(tempdir, 'META-INF/')
-                containerpath = os.path.join(tempdir, 'META-INF/container.xml')
-
-                # save score
-                tree.write(scorepath, encoding='utf8')
-
-                # create meta dir
-                os.mkdir(metapath)
-
-                # create container info
-                croot = ET.Element('container')
-                crootfiles = ET.SubElement(croot, 'rootfiles')
-                crootfile = ET.SubElement(crootfiles, 'rootfile', attrib={'full-path': 'score.mscx'})
-                ctree = ET.ElementTree(croot)
-                ctree.write(containerpath, encoding='utf8')
-
-                # zip dir
-                with zipfile.ZipFile(outpath, 'w', zipfile.ZIP_DEFLATED) as fd:
-                    for root, dirs, files in os.walk(tempdir):
-                        for file in files:
-                            dst_path = os.path.join(root, file)
-                            arc_path = os.path.relpath(dst_path, tempdir)
-                            fd.write(dst_path, arc_path)
-
-
-    def write(self, outpath):
-        self._write_tree(self.tree, outpath)
-
-
-    def split(self, outdir):
-        '''Splits a file at VBOX-Elements into multiple files.'''
-        # copy tree as template for parts and remove content
-        template = copy.deepcopy(self.tree)
-        templatestaff = MuseScoreFile._get_staff_element_from_tree(template)
-        templatecontent = MuseScoreFile._get_staff_content_from_tree(template)
-        for e in templatecontent:
-            templatestaff.remove(e)
-
-        # extract part and create new copy of template
-        parts = []
-        content = self.get_staff_content()
-        for e in content:
-            if e.tag == 'VBox':
-                # extract title and create new part
-                titles = e.findall('''Text/style/[.='Title']/../text''')
-                if len(titles) == 1:
-                    title = titles[0].text
-                elif len(titles) == 0:
-                    title = 'unknown_title_{}'.format(len(parts) + 1)
-                else:
-                    print('error')      # TODO
-                    title = 'unknown_title_{}'.format(len(parts) + 1)
+        if ext not in ('.mscx', '.mscz'):
+            return
+        if ext == '.mscz' and source_archive is not None:
+            with instrumentation.phase('copy'):
+                rootfile, entries = MuseScoreFile._read_raw_entries(source_archive)
+        with _replace_file(outpath, backup, sync) as temppath:
+            if ext == '.mscx':
+                with open(temppath, 'wb') as fd:
+                    MuseScoreFile._serialize_tree(tree, fd)
+            elif source_archive is not None:
+                with MuseScoreFile._open_zip_file(temppath, compression, compresslevel) as archive:
+                    for info, data in entries:
+                        if data is None:
+                            with archive.open(MuseScoreFile._entry_info(archive, rootfile), 'w') as fd:
+                                MuseScoreFile._serialize_tree(tree, fd)
+                        else:
+                            with instrumentation.phase('copy'):
+                                MuseScoreFile._write_raw_entry(archive, info, data)
+            else:
+                # serialize score and container info directly into the archive
+                with MuseScoreFile._open_zip_file(temppath, compression, compresslevel) as archive:
+                    with archive.open(MuseScoreFile._entry_info(archive, 'score.mscx'), 'w') as fd:
+                        MuseScoreFile._serialize_tree(tree, fd)
+                    MuseScoreFile._write_container(archive, 'score.mscx')
+
+
+    def write(self, outpath, compression=zipfile.ZIP_DEFLATED, compresslevel=None, backup=False, sync=None):
+        '''Writes the score to a .mscx or .mscz file.
+
+        For .mscz files the compression method (e.g. zipfile.ZIP_STORED for
+        speed) and compression level of the archive can be chosen. If the
+        score was loaded from a .mscz file, all other entries of that archive
+        (thumbnails, images, audio...) are copied as they are, without
+        decompressing and compressing them again.
+
+        The score is written to a temporary file that replaces outpath when it
+        is complete, so an interrupted write never leaves a truncated file.
+        With backup the old file is kept as outpath + '~', as hard link
+        instead of a copy. sync is True to flush the file to disk before it
+        replaces the old one, or a SyncBatch to flush many files at once.
+        '''
+        with instrumentation.operation('write', outpath):
+            self._write_tree(self.tree, outpath, compression, compresslevel, self.source_archive, backup, sync)
 
-                parts.append({'title': title, 'elements': []})
 
-            # add element to current part
-            parts[-1]['elements'].append(e)
+    @staticmethod
+    def _compress_score(data, rootfile, compression, compresslevel):
+        '''Compresses the score XML for an archive entry like ZipFile does, returns (ZipInfo, data) or None.
+
+        Only stored and deflated entries are supported, for other methods
+        None is returned and every archive compresses the score itself.
+        '''
+        if compression == zipfile.ZIP_STORED:
+            compressed = data
+        elif compression == zipfile.ZIP_DEFLATED:
+            with instrumentation.phase('compress'):
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel,
+                                              zlib.DEFLATED, -15)
+                compressed = compressor.compress(data) + compressor.flush()
+        else:
+            return None
+        # the same header as ZipFile.open() writes
+        info = _zip_info(rootfile, compression, compresslevel)
+        info.file_size = len(data)
+        info.compress_size = len(compressed)
+        info.CRC = zlib.crc32(data)
+        return info, compressed
 
-        # output parts to different files
-        for part in parts:
-            part_tree = copy.deepcopy(template)
-            part_staff = MuseScoreFile._get_staff_element_from_tree(part_tree)
-            for e in part['elements']:
-                part_staff.append(e)
 
-            part_path = part['title']
+    @staticmethod
+    def _write_score_entry(archive, rootfile, entry, data):
+        if entry is None:
+            with archive.open(MuseScoreFile._entry_info(archive, rootfile), 'w') as fd:
+                instrumentation.writer(fd).write(data)
+        else:
+            info, compressed = entry
+            with instrumentation.phase('write'):
+                MuseScoreFile._write_raw_entry(archive, info, compressed)
+            instrumentation.count('bytes_written', len(compressed))
+
+
+    def write_many(self, outpaths, compression=zipfile.ZIP_DEFLATED, compresslevel=None, backup=False, sync=None,
+                   workers=None):
+        '''Writes the score to several .mscx and .mscz files, serializing it only once.
+
+        The XML is kept in memory and compressed once for all .mscz files,
+        in the background while the .mscx files are written. The files are
+        written by a pool of threads, at most workers at the same time
+        (default: all). The files are the same as written by write(), backup
+        and sync work the same way. Paths naming the same file (e.g. a.mscz
+        and ./a.mscz) are written once.
+        '''
+        unique = collections.OrderedDict()
+        for outpath in outpaths:
+            if os.path.splitext(outpath)[1] not in ('.mscx', '.mscz'):
+                raise MuseScoreException('invalid MuseScore file: {}'.format(outpath))
+            # two threads must not replace the same file at once
+            unique.setdefault(os.path.realpath(outpath), outpath)
+        outpaths = list(unique.values())
+        if not outpaths:
+            return
+        with instrumentation.operation('write', outpaths[0]):
+            # the threads continue the operation, also if it is part of another one
+            report = instrumentation.current()
+            instrumentation.count('targets', len(outpaths))
+            buffer = io.BytesIO()
+            with instrumentation.phase('serialize'):
+                _backend.write(self.tree, buffer)
+            data = buffer.getvalue()
+            del buffer
+            entries = None
+            rootfile = 'score.mscx'
+            archives = [outpath for outpath in outpaths if outpath.endswith('.mscz')]
+            if archives and self.source_archive is not None:
+                with instrumentation.phase('copy'):
+                    rootfile, entries = MuseScoreFile._read_raw_entries(self.source_archive)
+
+            def compress():
+                with instrumentation.attach(report):
+                    return MuseScoreFile._compress_score(data, rootfile, compression, compresslevel)
+
+            def write_file(outpath, entry):
+                with instrumentation.attach(report), _replace_file(outpath, backup, sync) as temppath:
+                    if outpath.endswith('.mscx'):
+                        with open(temppath, 'wb') as fd:
+                            instrumentation.writer(fd).write(data)
+                        return
+                    entry = entry.result()
+                    with MuseScoreFile._open_zip_file(temppath, compression, compresslevel) as archive:
+                        if entries is None:
+                            MuseScoreFile._write_score_entry(archive, rootfile, entry, data)
+                            MuseScoreFile._write_container(archive, rootfile)
+                            return
+                        for info, raw in entries:
+                            if raw is None:
+                                MuseScoreFile._write_score_entry(archive, rootfile, entry, data)
+                            else:
+                                with instrumentation.phase('copy'):
+                                    MuseScoreFile._write_raw_entry(archive, info, raw)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=(workers or len(outpaths)) + 1) as executor:
+                # submitted first, so it runs before the archives that wait for it
+                entry = executor.submit(compress) if archives else None
+                futures = [executor.submit(write_file, outpath, entry) for outpath in outpaths]
+                concurrent.futures.wait(futures)
+            for future in futures:
+                future.result()
+
 
-            # Sanitize path a bit (complete sanitation is complex, so lets do that another time)
-            part_path = part_path.replace('\n', ' ')
-            part_path = part_path.replace('\r', '')
-            part_path = part_path.replace('\t', ' ')
-            part_path = part_path.replace('<', '')
-            part_path = part_path.replace('>', '')
-            part_path = part_path.replace(':', '')
-            part_path = part_path.replace('"', '')
-            part_path = part_path.replace('/', '')
-            part_path = part_path.replace('\\', '')
-            part_path = part_path.replace('|', '')
-            part_path = part_path.replace('?', '')
-            part_path = part_path.replace('*', '')
+    @staticmethod
+    @contextlib.contextmanager
+    def _open_output(outpath, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+        '''Opens a binary file object the score XML can be written to, for .mscz files inside the archive.
+
+        outpath is replaced when the block is left without an exception.
+        '''
+        _, ext = os.path.splitext(outpath)
+        if ext not in ('.mscx', '.mscz'):
+            raise MuseScoreException('invalid MuseScore file')
+        with _replace_file(outpath) as temppath:
+            if ext == '.mscx':
+                with open(temppath, 'wb') as fd:
+                    yield instrumentation.writer(fd)
+            else:
+                with MuseScoreFile._open_zip_file(temppath, compression, compresslevel) as archive:
+                    with archive.open(MuseScoreFile._entry_info(archive, 'score.mscx'), 'w') as fd:
+                        yield instrumentation.writer(fd)
+                    MuseScoreFile._write_container(archive, 'score.mscx')
+
+
+    @staticmethod
+    def _write_data(chunks, outpath, compression=zipfile.ZIP_DEFLATED, compresslevel=None):
+        '''Writes an already serialized score (sequence of byte strings) to a .mscx or .mscz file.'''
+        with MuseScoreFile._open_output(outpath, compression, compresslevel) as fd:
+            fd.writelines(chunks)
 
-            part_path = os.path.join(outdir, part_path + '.mscz')
 
-            # Change path if file already exists, to avoid overwriting files
-            if os.path.isfile(part_path):
-                part_path = os.path.join(outdir, part['title'] + '-' + uuid.uuid4().hex[:8] + '.mscz')
+    @staticmethod
+    def _serialize_template(tree):
+        '''Serializes the tree without the content of its staffs.
+
+        Returns the byte strings in between the staff contents, for a score
+        with one staff that is the part before and the part after the content.
+        The tree is not modified, so it may be shared with other threads.
+        '''
+        root = tree.getroot()
+        chunks = [_XML_DECLARATION]
+        _serialize(root, chunks, hidden=set(root.findall('Score/Staff')))
+        return ''.join(chunks).encode('utf8').split('<{} />'.format(_CONTENT_PLACEHOLDER).encode('utf8'))
+
+
+    @staticmethod
+    def _serialize_elements(elements):
+        return b''.join(_backend.tostring(e) for e in elements)
+
+
+    @staticmethod
+    def _get_part_path(outdir, title, used_paths):
+        part_path = title
+
+        # Sanitize path a bit (complete sanitation is complex, so lets do that another time)
+        part_path = part_path.replace('\n', ' ')
+        part_path = part_path.replace('\r', '')
+        part_path = part_path.replace('\t', ' ')
+        part_path = part_path.replace('<', '')
+        part_path = part_path.replace('>', '')
+        part_path = part_path.replace(':', '')
+        part_path = part_path.replace('"', '')
+        part_path = part_path.replace('/', '')
+        part_path = part_path.replace('\\', '')
+        part_path = part_path.replace('|', '')
+        part_path = part_path.replace('?', '')
+        part_path = part_path.replace('*', '')
+
+        part_path = os.path.join(outdir, part_path + '.mscz')
+
+        # Change path if file already exists, to avoid overwriting files
+        if os.path.isfile(part_path) or part_path in used_paths:
+            part_path = os.path.join(outdir, title + '-' + uuid.uuid4().hex[:8] + '.mscz')
+        used_paths.add(part_path)
+        return part_path
+
+
+    @staticmethod
+    def _part_title(texts, count):
+        '''Returns the title of the count-th part from the title texts of its VBox.'''
+        if len(texts) == 1:
+            return texts[0].text
+        if len(texts) > 1:
+            logger.warning('too many titles in VBox')      # TODO
+        return 'unknown_title_{}'.format(count)
+
+
+    @staticmethod
+    def _iter_parts(content, titles=None):
+        '''Groups staff content into parts starting with a VBox and yields them as (title, elements).
+
+        Title texts of the VBoxes are taken from titles (see ScoreIndex) if given.
+        '''
+        starts = [i for i, e in enumerate(content) if e.tag == 'VBox']
+        if content and (not starts or starts[0] != 0):
+            raise MuseScoreException('score does not start with a VBox')
+        for count, (start, end) in enumerate(zip(starts, starts[1:] + [len(content)]), 1):
+            # extract title
+            texts = titles[content[start]] if titles is not None else _find_titles(content[start])
+            yield MuseScoreFile._part_title(texts, count), content[start:end]
+
+
+    @staticmethod
+    def _iter_staff_parts(contents, titles=None):
+        '''Splits the content of all staffs into parts and yields them as (title, [elements of every staff]).
+
+        Parts start at the VBoxes of the first staff, the other staffs are cut
+        before the same measures. The content lists are sliced, so no element
+        is moved or copied.
+        '''
+        # positions of the measures in the other staffs
+        others = [(content, [i for i, e in enumerate(content) if e.tag == 'Measure']) for content in contents[1:]]
+        starts = [0] * len(others)
+        measures = 0
+        for title, elements in MuseScoreFile._iter_parts(contents[0], titles):
+            measures += sum(1 for e in elements if e.tag == 'Measure')
+            parts = [elements]
+            for k, (content, positions) in enumerate(others):
+                end = positions[measures] if measures < len(positions) else len(content)
+                parts.append(content[starts[k]:end])
+                starts[k] = end
+            yield title, parts
+
+
+    @staticmethod
+    def _check_aligned(name, measures):
+        if len(set(measures)) > 1:
+            raise MuseScoreException('staffs of {} have different numbers of measures: {}'.format(
+                name, ', '.join(str(m) for m in measures)))
+
+
+    def split(self, outdir, workers=1, compression=zipfile.ZIP_DEFLATED, compresslevel=None, progress=None):
+        '''Splits a file at VBOX-Elements into multiple files.
+
+        The score header is serialized once and shared by all parts, with
+        more than one worker up to that many parts are written concurrently.
+        Returns the paths of the written parts.
+
+        A score that has not been loaded (or changed) yet is streamed from its
+        file: every element is serialized as soon as it has been read and
+        dropped, the serialized staffs are buffered in temporary files (in
+        memory up to MERGE_BUFFER_SIZE bytes per staff). The parts are
+        written from these buffers once the end of the score is known, so
+        memory is bounded by the buffers and the largest part, not by the
+        size of the score. A loaded score is split from its tree.
+
+        Scores with several staffs (e.g. choir or piano scores) are split at
+        the VBoxes of the first staff, all staffs must have the same number
+        of measures.
+
+        progress is called as progress(done, total, path) after every written part.
+        '''
+        with instrumentation.operation('split', self.filepath):
+            if self._tree is None and self._cache is None:
+                return self._split_stream(outdir, workers, compression, compresslevel, progress)
+            return self._split_tree(outdir, workers, compression, compresslevel, progress)
+
+
+    def _split_tree(self, outdir, workers, compression, compresslevel, progress):
+        contents = self.get_staff_contents()
+        MuseScoreFile._check_aligned(self.filepath, [len(m) for m in self.index.measures])
+        with instrumentation.phase('serialize'):
+            segments = MuseScoreFile._serialize_template(self.tree)
+        instrumentation.count('elements', sum(len(content) for content in contents))
+        parts = MuseScoreFile._iter_staff_parts(contents, self.index.titles)
+        return MuseScoreFile._write_parts(outdir, segments, parts, len(self.index.vboxes), MuseScoreFile._serialize_elements,
+                                          workers, compression, compresslevel, progress)
+
+
+    def _split_stream(self, outdir, workers, compression, compresslevel, progress):
+        roots = []
+        buffers = []
+        # offsets in the buffer of every staff at which the parts start
+        starts = []
+        measures = []
+        titles = []
+        # measures of the first staff in front of every part
+        part_measures = []
+        elements = 0
+        try:
+            with instrumentation.phase('parse'):
+                for staff_index, e in MuseScoreFile.iter_staff_content(self.filepath, roots):
+                    while len(buffers) <= staff_index:
+                        # the first part starts with the content of the other staffs, in the first one with a VBox
+                        starts.append([0] if buffers else [])
+                        buffers.append(tempfile.SpooledTemporaryFile(MERGE_BUFFER_SIZE))
+                        measures.append(0)
+                    buffer = buffers[staff_index]
+                    if staff_index == 0:
+                        if e.tag == 'VBox':
+                            # the previous part is complete, the next one starts here
+                            starts[0].append(buffer.tell())
+                            part_measures.append(measures[0])
+                            titles.append(MuseScoreFile._part_title(_find_titles(e), len(titles) + 1))
+                        elif not titles:
+                            raise MuseScoreException('score does not start with a VBox')
+                    elif e.tag == 'Measure':
+                        # the other staffs are cut before the same measures as the first one
+                        while len(starts[staff_index]) < len(part_measures) and \
+                                part_measures[len(starts[staff_index])] == measures[staff_index]:
+                            starts[staff_index].append(buffer.tell())
+                    if e.tag == 'Measure':
+                        measures[staff_index] += 1
+                    with instrumentation.phase('serialize'):
+                        buffer.write(MuseScoreFile._serialize_elements((e,)))
+                    elements += 1
+            if not roots:
+                raise MuseScoreException('Could not parse file: no root element')
+            header = _backend.element_tree(roots[0])
+            staff_count = len(MuseScoreFile._get_staffs_from_tree(header))
+            # staffs without any content
+            measures += [0] * (staff_count - len(measures))
+            MuseScoreFile._check_aligned(self.filepath, measures)
+            with instrumentation.phase('serialize'):
+                segments = MuseScoreFile._serialize_template(header)
+            instrumentation.count('elements', elements)
+            for buffer, offsets in zip(buffers, starts):
+                # the parts not started in a staff are empty
+                offsets += [buffer.tell()] * (len(titles) + 1 - len(offsets))
+
+            def iter_parts():
+                for k, title in enumerate(titles):
+                    parts = []
+                    for buffer, offsets in zip(buffers, starts):
+                        buffer.seek(offsets[k])
+                        parts.append(buffer.read(offsets[k + 1] - offsets[k]))
+                    parts += [b''] * (staff_count - len(parts))
+                    yield title, parts
+
+            return MuseScoreFile._write_parts(outdir, segments, iter_parts(), len(titles), None, workers, compression,
+                                              compresslevel, progress)
+        finally:
+            for buffer in buffers:
+                buffer.close()
+
+
+    @staticmethod
+    def _write_parts(outdir, segments, parts, total, serialize, workers, compression, compresslevel, progress):
+        '''Writes parts given as (title, [content of every staff]) with the serialized template.
+
+        The content is serialized with serialize, if it is not serialized already (serialize is None).
+        '''
+        report = instrumentation.current()
+
+        def write_part(parts, part_path):
+            # parts may be written by other threads
+            with instrumentation.attach(report):
+                chunks = [segments[0]]
+                with instrumentation.phase('serialize'):
+                    for content, segment in zip(parts, segments[1:]):
+                        chunks.append(content if serialize is None else serialize(content))
+                        chunks.append(segment)
+                MuseScoreFile._write_data(chunks, part_path, compression, compresslevel)
+                instrumentation.count('parts')
+
+        part_paths = []
+        used_paths = set()
+        if workers == 1:
+            for title, staff_parts in parts:
+                part_path = MuseScoreFile._get_part_path(outdir, title, used_paths)
+                write_part(staff_parts, part_path)
+                part_paths.append(part_path)
+                if progress is not None:
+                    progress(len(part_paths), total, part_path)
+            return part_paths
+
+        def wait_for(futures, return_when):
+            done, pending = concurrent.futures.wait(futures, return_when=return_when)
+            for future in done:
+                future.result()
+                if progress is not None:
+                    written.append(futures[future])
+                    progress(len(written), total, futures[future])
+            return {future: futures[future] for future in pending}
+
+        written = []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for title, staff_parts in parts:
+                part_path = MuseScoreFile._get_part_path(outdir, title, used_paths)
+                # limit the parts in flight to keep memory bounded
+                if workers is not None and len(futures) >= workers:
+                    futures = wait_for(futures, concurrent.futures.FIRST_COMPLETED)
+                futures[executor.submit(write_part, staff_parts, part_path)] = part_path
+                part_paths.append(part_path)
+            wait_for(futures, concurrent.futures.ALL_COMPLETED)
+        return part_paths
+
 
-            MuseScoreFile._write_tree(part_tree, part_path)
+    @staticmethod
+    def _get_rootfile(archive):
+        try:
+            container = archive.open('META-INF/container.xml')
+        except KeyError:
+            raise MuseScoreException('invalid MuseScore file: no META-INF/container.xml')
+        with container as fd:
+            parser = ET.XMLParser(encoding='utf-8')
+            try:
+                rootfiles = ET.parse(fd, parser=parser).getroot().findall('rootfiles/rootfile')
+                rootfiles = [f.get('full-path') for f in rootfiles if f.get('full-path').endswith('.mscx')]
+            except ET.ParseError as e:
+                raise MuseScoreException('Could not parse file: {}'.format(e))
+            if len(rootfiles) != 1:
+                raise Exception('too many rootfiles')
+            return rootfiles[0]
 
 
     @staticmethod
     def load_zip_file(filepath):
         with zipfile.ZipFile(filepath, 'r') as archive:
-            with archive.open('META-INF/container.xml') as fd:
-                parser = ET.XMLParser(encoding='utf-8')
+            rootfile = MuseScoreFile._get_rootfile(archive)
+            with archive.open(rootfile) as fd, instrumentation.phase('parse'):
                 try:
-                    rootfiles = ET.parse(fd, parser=parser).getroot().findall('rootfiles/rootfile')
-                    rootfiles = [f.get('full-path') for f in rootfiles if f.get('full-path').endswith('.mscx')]
-                except ET.ParseError as e:
-                    raise MuseScoreException('Could not parse file: {}'.format(e))
-                if len(rootfiles) != 1:
-                    raise Exception('too many rootfiles')
-                rootfile = rootfiles[0]
-
-            with archive.open(rootfile) as fd:
-                parser = ET.XMLParser(encoding='utf-8')
-                try:
-                    tree = ET.parse(fd, parser=parser)
-                except ET.ParseError as e:
+                    tree = _backend.parse(instrumentation.reader(fd))
+                except _backend.ParseError as e:
                     raise MuseScoreException('Could not parse file: {}'.format(e))
         return tree
 
 
     @staticmethod
     def load_xml_file(filepath):
-        with open(filepath, encoding='utf8') as fd:
-            parser = ET.XMLParser(encoding='utf-8')
+        with open(filepath, 'rb') as fd, instrumentation.phase('parse'):
             try:
-                tree = ET.parse(fd, parser=parser)
-            except ET.ParseError as e:
+                tree = _backend.parse(instrumentation.reader(fd))
+            except _backend.ParseError as e:
                 raise MuseScoreException('Could not parse file: {}'.format(e))
         return tree
 
 
     @staticmethod
-    def merge_files(mainfile, contentfiles, output):
-        # load mainfile
-        if not isinstance(mainfile, MuseScoreFile):
-            mainfile = MuseScoreFile(mainfile)
-        mainstaff = mainfile.get_staff_element()
-        maincontent = mainfile.get_staff_content()
+    @contextlib.contextmanager
+    def open_score(filepath):
+        '''Opens the score XML of a .mscx or .mscz file as binary file object.'''
+        _, ext = os.path.splitext(filepath)
+        if ext == '.mscx':
+            with open(filepath, 'rb') as fd:
+                yield fd
+        elif ext == '.mscz':
+            with zipfile.ZipFile(filepath, 'r') as archive:
+                rootfile = MuseScoreFile._get_rootfile(archive)
+                with archive.open(rootfile) as fd:
+                    yield fd
+        else:
+            raise MuseScoreException('invalid MuseScore file')
+
+
+    @staticmethod
+    def _iterparse_staff_content(fd, roots=None):
+        depth = 0
+        in_score = False
+        staff = None
+        staff_index = -1
+        pending = None
+        try:
+            for event, elem in _backend.iterparse(fd):
+                if event == 'start':
+                    depth += 1
+                    if depth == 1 and roots is not None:
+                        roots.append(elem)
+                    elif depth == 2:
+                        in_score = elem.tag == 'Score'
+                    elif depth == 3 and in_score and elem.tag == 'Staff':
+                        staff = elem
+                        staff_index += 1
+                    elif depth == 4 and pending is not None:
+                        # the tail of an element is only known when its next sibling starts,
+                        # lxml keeps the tail with the element when it is detached after that
+                        staff.remove(pending)
+                        yield staff_index, pending
+                        pending = None
+                else:
+                    if depth == 4 and staff is not None:
+                        pending = elem
+                    elif depth == 3 and elem is staff:
+                        if pending is not None:
+                            staff.remove(pending)
+                            yield staff_index, pending
+                            pending = None
+                        staff = None
+                    depth -= 1
+        except _backend.ParseError as e:
+            raise MuseScoreException('Could not parse file: {}'.format(e))
 
-        # remove content from mainfile
-        for e in maincontent:
-            mainstaff.remove(e)
 
-        # add content from contentfiles
-        for f in contentfiles:
-            if not isinstance(f, MuseScoreFile):
-                f = MuseScoreFile(f)
-            mainstaff.extend(f.get_staff_content())
+    @staticmethod
+    def iter_staff_content(filepath, roots=None):
+        '''Yields (staff index, element) for every child of Score/Staff without loading the whole score.
 
-        # write file to output
-        mainfile.write(output)
+        The score is read incrementally and every element is detached from the
+        tree once it has been yielded, so the memory needed is bounded by the
+        largest element (usually a measure) plus the score header. If a list
+        is given as roots, the root element is appended to it, e.g. to read
+        the header along the way.
+        '''
+        with MuseScoreFile.open_score(filepath) as fd:
+            for item in MuseScoreFile._iterparse_staff_content(instrumentation.reader(fd), roots):
+                yield item
 
 
-def merge_files(files, output_file):
+    @staticmethod
+    def load_header(filepath):
+        '''Loads a score without the content of its staffs by streaming over it.'''
+        roots = []
+        with MuseScoreFile.open_score(filepath) as fd, instrumentation.phase('parse'):
+            for _ in MuseScoreFile._iterparse_staff_content(instrumentation.reader(fd), roots):
+                pass
+        if not roots:
+            raise MuseScoreException('Could not parse file: no root element')
+        return _backend.element_tree(roots[0])
+
+
+    @staticmethod
+    def probe(filepath, fields=PROBE_FIELDS):
+        '''Reads the metadata of a score without parsing all of it and returns a ScoreInfo.
+
+        ScoreInfo has the version of the file format, the metaTag entries as
+        dict, the title of the VBox the first staff starts with (None without
+        one) and the number of staffs. The score is streamed and reading stops
+        as soon as the requested fields are known, usually after the header,
+        so errors further on in the file are not noticed. Fields not
+        requested are None.
+        '''
+        unknown = set(fields) - set(PROBE_FIELDS)
+        if unknown:
+            raise ValueError('unknown fields: {}'.format(', '.join(sorted(unknown))))
+        version = None
+        meta_tags = {}
+        title = None
+        part_staffs = 0
+        staffs = 0
+        meta_done = 'meta_tags' not in fields
+        title_done = 'title' not in fields
+        staffs_done = 'staff_count' not in fields
+        depth = 0
+        in_score = False
+        # child of Score the parser is in
+        section = None
+        with MuseScoreFile.open_score(filepath) as fd, instrumentation.phase('parse'):
+            try:
+                for event, elem in _backend.iterparse(instrumentation.reader(fd)):
+                    if event == 'start':
+                        depth += 1
+                        if depth == 1:
+                            version = elem.get('version')
+                        elif depth == 2:
+                            in_score = elem.tag == 'Score'
+                        elif depth == 3 and in_score:
+                            section = elem
+                            if elem.tag in ('Part', 'Staff'):
+                                # metaTags come before the parts
+                                meta_done = True
+                            if elem.tag == 'Staff':
+                                staffs += 1
+                                # the parts define all staffs before the first content
+                                staffs_done = staffs_done or part_staffs > 0
+                                title_done = title_done or staffs > 1
+                        elif depth == 4 and staffs == 1 and section.tag == 'Staff' and elem.tag == 'Measure':
+                            title_done = True
+                        if meta_done and title_done and staffs_done:
+                            break
+                    else:
+                        if depth == 3 and in_score and elem.tag == 'metaTag':
+                            meta_tags[elem.get('name')] = elem.text or ''
+                        elif depth == 4 and in_score:
+                            if section.tag == 'Part' and elem.tag == 'Staff':
+                                part_staffs += 1
+                            elif section.tag == 'Staff':
+                                if not title_done and elem.tag == 'VBox':
+                                    titles = _find_titles(elem)
+                                    if titles:
+                                        title = _text_of(titles[0])
+                                        title_done = True
+                                # the content is not needed, e.g. when counting staffs without parts
+                                section.remove(elem)
+                        depth -= 1
+            except _backend.ParseError as e:
+                raise MuseScoreException('Could not parse file: {}'.format(e))
+        if version is None:
+            raise MuseScoreException('Could not parse file: no root element')
+        return ScoreInfo(filepath, version,
+                         meta_tags if 'meta_tags' in fields else None,
+                         title,
+                         (part_staffs or staffs) if 'staff_count' in fields else None)
+
+
+    @staticmethod
+    def file_contains_time_sig(filepath):
+        '''Streaming variant of contains_time_sig() that stops at the first time signature.'''
+        for _, e in MuseScoreFile.iter_staff_content(filepath):
+            if e.tag == 'Measure' and e.find('voice/TimeSig') is not None:
+                return True
+        return False
+
+
+    @staticmethod
+    def merge_files(mainfile, contentfiles, output, compression=zipfile.ZIP_DEFLATED, compresslevel=None, progress=None):
+        '''Writes the staff content of all content files into the main file and saves it as output.
+
+        Content files given by path are streamed into the output one after
+        another, so only a single measure of them is held in memory at a time.
+        A main file given by path is loaded without its staff content. If it
+        is the first content file as well, its header is read along with its
+        content, so it is parsed only once. As the header is only complete at
+        the end of the file, the content of that file is buffered like the
+        staffs below.
+        progress is called as progress(done, total, file) after every content file.
+
+        Scores with several staffs (e.g. choir or piano scores) are merged
+        staff by staff, all files need the same number of staffs and the staffs
+        of a file the same number of measures. The first staff is written
+        directly, the others are buffered in temporary files (in memory up to
+        MERGE_BUFFER_SIZE bytes per staff) until the first staff is complete.
+        '''
+        contentfiles = list(contentfiles)
+        with instrumentation.operation('merge', output):
+            # load header of mainfile
+            roots = None
+            if isinstance(mainfile, MuseScoreFile):
+                maintree = mainfile.tree
+            elif contentfiles and contentfiles[0] == mainfile:
+                # read with the content of the first file
+                maintree = None
+                roots = []
+            else:
+                maintree = MuseScoreFile.load_header(mainfile)
+
+            # add content from contentfiles
+            elements = 0
+            buffers = []
+            try:
+                with MuseScoreFile._open_output(output, compression, compresslevel) as fd:
+
+                    def start(tree):
+                        # writes the template up to the first staff, returns the number of staffs and the template
+                        count = len(MuseScoreFile._get_staffs_from_tree(tree))
+                        with instrumentation.phase('serialize'):
+                            template = MuseScoreFile._serialize_template(tree)
+                        fd.write(template[0])
+                        return count, template
+
+                    def add_buffer():
+                        buffer = tempfile.SpooledTemporaryFile(MERGE_BUFFER_SIZE)
+                        buffers.append(buffer)
+                        return buffer
+
+                    staff_count = segments = None
+                    # until the header is known all staffs are buffered
+                    targets = []
+                    if maintree is not None:
+                        staff_count, segments = start(maintree)
+                        targets = [fd] + [add_buffer() for _ in range(staff_count - 1)]
+                    measures = [0] * len(targets)
+                    for i, f in enumerate(contentfiles):
+                        file_measures = [0] * len(targets)
+                        if isinstance(f, MuseScoreFile):
+                            contents = f.get_staff_contents()
+                            if len(contents) != staff_count:
+                                raise MuseScoreException('{} has {} staffs instead of {}'.format(f.filepath, len(contents), staff_count))
+                            for staff_index, content in enumerate(contents):
+                                with instrumentation.phase('serialize'):
+                                    data = MuseScoreFile._serialize_elements(content)
+                                targets[staff_index].write(data)
+                                elements += len(content)
+                                file_measures[staff_index] = sum(1 for e in content if e.tag == 'Measure')
+                            name = f.filepath
+                        else:
+                            staffs = 0
+                            with instrumentation.phase('parse'):
+                                for staff_index, e in MuseScoreFile.iter_staff_content(f, roots if i == 0 else None):
+                                    if staff_count is None:
+                                        while len(targets) <= staff_index:
+                                            targets.append(add_buffer())
+                                            file_measures.append(0)
+                                    elif staff_index >= staff_count:
+                                        raise MuseScoreException('{} has more than {} staffs'.format(f, staff_count))
+                                    staffs = staff_index + 1
+                                    with instrumentation.phase('serialize'):
+                                        data = MuseScoreFile._serialize_elements((e,))
+                                    targets[staff_index].write(data)
+                                    elements += 1
+                                    if e.tag == 'Measure':
+                                        file_measures[staff_index] += 1
+                            if staff_count is None:
+                                # the header of the main file is complete, its first staff is copied behind it
+                                if not roots:
+                                    raise MuseScoreException('Could not parse file: no root element')
+                                staff_count, segments = start(_backend.element_tree(roots[0]))
+                                if targets:
+                                    targets[0].seek(0)
+                                    shutil.copyfileobj(targets[0], fd)
+                                    targets[0].close()
+                                    targets[0] = fd
+                                else:
+                                    targets.append(fd)
+                                while len(targets) < staff_count:
+                                    targets.append(add_buffer())
+                                file_measures += [0] * (staff_count - len(file_measures))
+                                measures = [0] * staff_count
+                            if staffs != staff_count:
+                                raise MuseScoreException('{} has {} staffs instead of {}'.format(f, staffs, staff_count))
+                            name = f
+                        MuseScoreFile._check_aligned(name, file_measures)
+                        measures = [m + n for m, n in zip(measures, file_measures)]
+                        if progress is not None:
+                            progress(i + 1, len(contentfiles), f)
+
+                    # append the buffered staffs
+                    for segment, buffer in zip(segments[1:], targets[1:]):
+                        fd.write(segment)
+                        buffer.seek(0)
+                        shutil.copyfileobj(buffer, fd)
+                    fd.write(segments[-1])
+            finally:
+                for buffer in buffers:
+                    buffer.close()
+            instrumentation.count('files', len(contentfiles))
+            instrumentation.count('elements', elements)
+            instrumentation.count('measures', sum(measures))
+
+
+def _is_score_name(name):
+    return not name.startswith('.') and name.endswith(SCORE_EXTENSIONS)
+
+
+def iter_score_files(directory, recursive=False):
+    '''Yields the paths of the .mscx and .mscz files in a directory.
+
+    Hidden files (e.g. the temporary files of atomic writes) are skipped, as
+    are hidden directories when the subdirectories are searched as well.
+    '''
+    if recursive:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if _is_score_name(name):
+                    yield os.path.join(root, name)
+    else:
+        for entry in os.scandir(directory):
+            if _is_score_name(entry.name) and entry.is_file():
+                yield entry.path
+
+
+def merge_files(files, output_file, cache=None, progress=None):
     if len(files) == 0:
         raise MuseScoreException('merge without failes not possible')
 
-    msf_main = MuseScoreFile(files[0])
-    msf = []
-    for f in files:
-        msf.append(MuseScoreFile(f))
-    MuseScoreFile.merge_files(msf_main, msf, output_file)
+    if cache is not None:
+        files = [MuseScoreFile(f, cache=cache) for f in files]
+    MuseScoreFile.merge_files(files[0], files, output_file, progress=progress)
 
 
-def convert_files(files, copy_titles=False, remove_newlines=False, remove_clefs=False, add_section_break=False, fix_key_sig=False):
-    for f in files:
-        # load file
-        msf = MuseScoreFile(f)
+class ConvertManifest(object):
+    '''Records content hash and conversion options of converted files.
+
+    Used by convert_files for incremental conversion: a file is skipped if its
+    hash and the options of the plan match the last run.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        if path is not None and os.path.isfile(path):
+            with open(path, encoding='utf8') as fd:
+                try:
+                    self.entries = json.load(fd)
+                except ValueError as e:
+                    raise MuseScoreException('Could not parse manifest: {}'.format(e))
+
+    @staticmethod
+    def file_hash(filepath):
+        h = hashlib.sha256()
+        with open(filepath, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def is_current(self, filepath, plan, file_hash):
+        entry = self.entries.get(os.path.abspath(filepath))
+        return entry is not None and entry['hash'] == file_hash and entry['options'] == plan.names()
+
+    def update(self, filepath, plan, file_hash):
+        self.entries[os.path.abspath(filepath)] = {'hash': file_hash, 'options': plan.names()}
+
+    def subset(self, filepath):
+        '''Returns a manifest with only the entry of the given file and no path, e.g. to send it to a worker process.'''
+        manifest = ConvertManifest()
+        entry = self.entries.get(os.path.abspath(filepath))
+        if entry is not None:
+            manifest.entries[os.path.abspath(filepath)] = entry
+        return manifest
+
+    def save(self):
+        if self.path is None:
+            return
+        temppath = self.path + '.tmp'
+        with open(temppath, 'w', encoding='utf8') as fd:
+            json.dump(self.entries, fd, indent=1, sort_keys=True)
+        os.replace(temppath, self.path)
 
-        # convert file
-        if copy_titles:
-            msf.set_text_as_title()
-        if remove_newlines:
-            msf.remove_newlines()
-        if remove_clefs:
-            msf.remove_clefs()
-        if add_section_break:
-            msf.add_sectionbreak()
-        if fix_key_sig:
-            msf.fix_key_sig()
 
-        # create backup
-        shutil.copy(f, f + '~')
+ConvertResult = collections.namedtuple('ConvertResult', ['path', 'success', 'exception', 'duration', 'written', 'file_hash', 'report'])
 
-        # write file
-        msf.write(f)
+
+def convert_file(f, plan, cache=None, manifest=None, sync=None):
+    '''Converts a single file in place and returns whether it was written.
+
+    The old file is kept as backup with the suffix ~ and replaced atomically,
+    sync is passed to MuseScoreFile.write(). With a ConvertManifest the file
+    is converted incrementally: it is skipped if content and options match
+    the manifest, and it is neither backed up nor written if the transforms
+    did not change anything.
+    '''
+    with instrumentation.operation('convert', f):
+        if manifest is not None:
+            with instrumentation.phase('hash'):
+                file_hash = manifest.file_hash(f)
+            if manifest.is_current(f, plan, file_hash):
+                return False
+
+        # load file
+        msf = MuseScoreFile(f, cache=cache)
+
+        # convert file
+        changed = msf.apply(plan)
+
+        if changed or manifest is None:
+            # write file and create backup
+            msf.write(f, backup=True, sync=sync)
+            if cache is not None:
+                cache.store(f, msf.tree)
+
+        if manifest is not None:
+            if changed:
+                with instrumentation.phase('hash'):
+                    file_hash = manifest.file_hash(f)
+            manifest.update(f, plan, file_hash)
+        return changed or manifest is None
+
+
+def _convert_file_with_result(f, plan, manifest, instrument=False):
+    if instrument:
+        # in a worker process the report is returned with the result and emitted by the main process
+        instrumentation.enable()
+    operation = instrumentation.operation('convert', f, emit_report=not instrument)
+    start = time.perf_counter()
+    try:
+        with operation as report:
+            written = convert_file(f, plan, manifest=manifest)
+    except Exception as e:
+        return ConvertResult(f, False, e, time.perf_counter() - start, False, None, report.as_dict() if instrument else None)
+    entry = manifest.entries.get(os.path.abspath(f)) if manifest is not None else None
+    return ConvertResult(f, True, None, time.perf_counter() - start, written, entry['hash'] if entry else None,
+                         report.as_dict() if instrument else None)
+
+
+def _get_manifest(manifest):
+    if manifest is None or isinstance(manifest, ConvertManifest):
+        return manifest
+    return ConvertManifest(manifest)
+
+
+def convert_files(files, copy_titles=False, remove_newlines=False, remove_clefs=False, add_section_break=False, fix_key_sig=False, plan=None, cache=None, manifest=None, sync=False):
+    '''Converts files in place. If a TransformPlan is given, the option flags are ignored.
+
+    Converted scores are stored in the given ScoreCache, so that following
+    operations on the same files do not parse them again. If a manifest (a
+    ConvertManifest or the path of its JSON file) is given, unchanged files
+    are skipped, see convert_file(). With sync the written files are flushed
+    to disk together at the end, see SyncBatch.
+    '''
+    if plan is None:
+        plan = TransformPlan.from_options(copy_titles=copy_titles, remove_newlines=remove_newlines, remove_clefs=remove_clefs,
+                                          add_section_break=add_section_break, fix_key_sig=fix_key_sig)
+    manifest = _get_manifest(manifest)
+    batch = SyncBatch() if sync else None
+    try:
+        for f in files:
+            convert_file(f, plan, cache, manifest, batch)
+    finally:
+        if batch is not None:
+            batch.sync()
+        if manifest is not None:
+            manifest.save()
+
+
+def convert_files_parallel(files, workers=None, plan=None, manifest=None, sync=False, **options):
+    '''Converts files in place using a pool of worker processes.
+
+    Failing files do not abort the batch, instead a ConvertResult is returned
+    for every file in the order of the input. The number of workers defaults
+    to the number of CPUs, with a single worker no pool is started. A
+    manifest enables incremental conversion and sync flushes the written
+    files at the end like for convert_files().
+    '''
+    if plan is None:
+        plan = TransformPlan.from_options(**options)
+    files = list(files)
+    manifest = _get_manifest(manifest)
+    if workers == 1:
+        results = [_convert_file_with_result(f, plan, manifest) for f in files]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # every task gets only the entry of its file, the whole manifest would be pickled for every file
+            manifests = (manifest.subset(f) for f in files) if manifest is not None else itertools.repeat(None)
+            results = list(executor.map(_convert_file_with_result, files, itertools.repeat(plan), manifests,
+                                        itertools.repeat(instrumentation.enabled)))
+        for result in results:
+            if result.report is not None:
+                instrumentation.emit(instrumentation.Report.from_dict(result.report))
+    if sync:
+        # fsync() flushes a file no matter which process has written it
+        batch = SyncBatch()
+        batch.paths = [result.path for result in results if result.written]
+        batch.sync()
+    if manifest is not None:
+        for result in results:
+            if result.success:
+                manifest.update(result.path, plan, result.file_hash)
+        manifest.save()
+    return results
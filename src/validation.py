@@ -0,0 +1,312 @@
+
+'''Checks the timing and signatures of scores, e.g. before merging them.
+
+While a score is streamed, the duration of every chord and rest is stored in
+flat arrays together with the voice it belongs to, and the length of every
+measure is taken from its len attribute or the active time signature. The
+checks then run over these arrays in bulk, with NumPy if it is installed:
+
+    overfull            a voice is longer than its measure
+    underfull           the first voice is shorter than its measure
+    missing_key_sig     the first measure of a staff has no key signature
+    missing_time_sig    the first measure of a staff has no time signature
+    stray_clef          a clef anywhere but at the start of a staff
+    unknown_duration    a chord or rest with a duration that is not known
+
+Only the first voice has to fill a measure, the other voices may have gaps.
+Durations are counted in quarter notes, grace notes take no time. Validate a
+whole library from the command line with:
+
+    python -m mst validate 'scores/**/*.mscz'
+'''
+
+import time
+import array
+import collections
+import concurrent.futures
+
+import musescore
+import instrumentation
+
+
+# durations in quarter notes
+DURATION_TYPES = {
+    'long': 16.0, 'breve': 8.0, 'whole': 4.0, 'half': 2.0, 'quarter': 1.0, 'eighth': 0.5, '16th': 0.25,
+    '32nd': 0.125, '64th': 0.0625, '128th': 0.03125, '256th': 0.015625, '512th': 0.0078125, '1024th': 0.00390625,
+}
+
+_GRACE_NOTES = frozenset(['acciaccatura', 'appoggiatura', 'grace4', 'grace8after', 'grace16', 'grace16after',
+                          'grace32', 'grace32after'])
+
+# tolerance for rounding errors of tuplets, far below the shortest note
+_EPSILON = 1e-6
+
+# NumPy takes longer to import than most commands take to run, so it is only imported for the checks
+_numpy = None
+
+Issue = collections.namedtuple('Issue', ['kind', 'staff', 'measure', 'voice', 'message'])
+
+ValidationResult = collections.namedtuple('ValidationResult', ['path', 'issues', 'exception', 'duration'])
+
+
+def _quarters_of(fraction):
+    numerator, _, denominator = fraction.partition('/')
+    return 4.0 * int(numerator) / int(denominator or 1)
+
+
+def _tuplet_ratio(tuplet):
+    normal = musescore._int_of(tuplet, 'normalNotes', 1)
+    actual = musescore._int_of(tuplet, 'actualNotes', 1)
+    return normal / actual if normal > 0 and actual > 0 else 1.0
+
+
+def _position(staff_index, ordinal, voice=None):
+    position = 'staff {}, measure {}'.format(staff_index + 1, ordinal + 1)
+    return position if voice is None else '{}, voice {}'.format(position, voice + 1)
+
+
+def _import_numpy():
+    '''Returns the numpy module, or None if it is not installed.'''
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def _as_numpy(numpy, a):
+    if not a:
+        return numpy.zeros(0, dtype=a.typecode)
+    return numpy.frombuffer(a, dtype=a.typecode)
+
+
+class _StaffState(object):
+    __slots__ = ('measures', 'time_sig')
+
+    def __init__(self):
+        self.measures = 0
+        # 4/4 if the staff has no time signature
+        self.time_sig = 4.0
+
+
+class ScoreTiming(object):
+    '''Durations of all chords and rests of a score in flat arrays.
+
+    Every voice of every measure gets an index, durations holds the duration
+    of each chord, rest or position change and element_voice the index of
+    its voice. For the voices, voice_measure holds the index of their measure
+    and voice_number the number within it, for the measures expected holds
+    their length and measure_staff and measure_ordinal their position.
+    '''
+    __slots__ = ('durations', 'element_voice', 'voice_measure', 'voice_number', 'expected', 'measure_staff',
+                 'measure_ordinal', 'found', '_staffs')
+
+    def __init__(self, content):
+        '''Extracts the durations from (staff index, element) pairs, see MuseScoreFile.iter_staff_content().'''
+        self.durations = array.array('d')
+        self.element_voice = array.array('l')
+        self.voice_measure = array.array('l')
+        self.voice_number = array.array('B')
+        self.expected = array.array('d')
+        self.measure_staff = array.array('l')
+        self.measure_ordinal = array.array('l')
+        # issues found while extracting, e.g. stray clefs
+        self.found = []
+        self._staffs = []
+        for staff_index, e in content:
+            while len(self._staffs) <= staff_index:
+                self._staffs.append(_StaffState())
+            if e.tag == 'Measure':
+                self._add_measure(staff_index, e)
+
+    def _add_measure(self, staff_index, measure):
+        state = self._staffs[staff_index]
+        ordinal = state.measures
+        state.measures += 1
+        voices = measure.findall('voice')
+        key_sig = False
+        time_sig = None
+        for voice in voices:
+            key_sig = key_sig or voice.find('KeySig') is not None
+            if time_sig is None:
+                time_sig = voice.find('TimeSig')
+        if time_sig is not None:
+            sig_n = musescore._int_of(time_sig, 'sigN', 0)
+            sig_d = musescore._int_of(time_sig, 'sigD', 0)
+            if sig_n > 0 and sig_d > 0:
+                state.time_sig = 4.0 * sig_n / sig_d
+        if ordinal == 0:
+            if not key_sig:
+                self.found.append(Issue('missing_key_sig', staff_index, ordinal, None,
+                                        '{}: no key signature'.format(_position(staff_index, ordinal))))
+            if time_sig is None:
+                self.found.append(Issue('missing_time_sig', staff_index, ordinal, None,
+                                        '{}: no time signature'.format(_position(staff_index, ordinal))))
+
+        # irregular measures, e.g. pickup measures, have their own length
+        length = measure.get('len')
+        length = _quarters_of(length) if length else state.time_sig
+        measure_index = len(self.expected)
+        self.expected.append(length)
+        self.measure_staff.append(staff_index)
+        self.measure_ordinal.append(ordinal)
+        for number, voice in enumerate(voices):
+            self._add_voice(staff_index, ordinal, measure_index, number, voice, length)
+
+    def _add_voice(self, staff_index, ordinal, measure_index, number, voice, length):
+        voice_index = len(self.voice_measure)
+        self.voice_measure.append(measure_index)
+        self.voice_number.append(min(number, 255))
+        durations = self.durations
+        element_voice = self.element_voice
+        position = 0.0
+        # ratio of the enclosing tuplets, MuseScore 3 ends a tuplet with endTuplet
+        ratios = [1.0]
+        # MuseScore 2 defines tuplets with an id, chords refer to it
+        tuplets = {}
+        for e in voice:
+            tag = e.tag
+            if tag == 'Chord' or tag == 'Rest':
+                duration = self._duration(e, length, tuplets, staff_index, ordinal, number) * ratios[-1]
+            elif tag == 'Tuplet':
+                if e.get('id') is not None:
+                    tuplets[e.get('id')] = _tuplet_ratio(e)
+                else:
+                    ratios.append(ratios[-1] * _tuplet_ratio(e))
+                continue
+            elif tag == 'endTuplet':
+                if len(ratios) > 1:
+                    ratios.pop()
+                continue
+            elif tag == 'location':
+                fraction = e.findtext('fractions')
+                if not fraction:
+                    continue
+                duration = _quarters_of(fraction)
+            else:
+                if tag == 'Clef' and (ordinal > 0 or position > 0):
+                    self.found.append(Issue('stray_clef', staff_index, ordinal, number, '{}: clef {}'.format(
+                        _position(staff_index, ordinal, number), e.findtext('concertClefType', ''))))
+                continue
+            durations.append(duration)
+            element_voice.append(voice_index)
+            position += duration
+
+    def _duration(self, element, length, tuplets, staff_index, ordinal, number):
+        # all children are looked at in one pass, chords have only a few
+        duration_type = duration = tuplet = None
+        dots = 0
+        for child in element:
+            tag = child.tag
+            if tag == 'durationType':
+                duration_type = child.text
+            elif tag == 'dots':
+                dots = int(child.text or 0)
+            elif tag == 'duration':
+                duration = child.text
+            elif tag == 'Tuplet':
+                tuplet = child.text
+            elif tag in _GRACE_NOTES:
+                return 0.0
+        if duration_type == 'measure':
+            return _quarters_of(duration) if duration else length
+        quarters = DURATION_TYPES.get(duration_type)
+        if quarters is None:
+            self.found.append(Issue('unknown_duration', staff_index, ordinal, number, '{}: unknown duration {}'.format(
+                _position(staff_index, ordinal, number), duration_type)))
+            return 0.0
+        if dots:
+            quarters *= 2.0 - 0.5 ** dots
+        if tuplet is not None:
+            quarters *= tuplets.get(tuplet, 1.0)
+        return quarters
+
+    @classmethod
+    def load(cls, filepath):
+        '''Extracts the durations of a .mscx or .mscz file in a single streaming pass.'''
+        return cls(musescore.MuseScoreFile.iter_staff_content(filepath))
+
+    @classmethod
+    def from_tree(cls, tree):
+        return cls((i, e) for i, staff in enumerate(tree.getroot().iterfind('Score/Staff')) for e in staff)
+
+    @property
+    def staff_count(self):
+        return len(self._staffs)
+
+    def voice_totals(self):
+        '''Returns the summed durations of all voices.'''
+        numpy = _import_numpy()
+        if numpy is not None:
+            return numpy.bincount(_as_numpy(numpy, self.element_voice), _as_numpy(numpy, self.durations),
+                                  len(self.voice_measure))
+        totals = [0.0] * len(self.voice_measure)
+        for voice_index, duration in zip(self.element_voice, self.durations):
+            totals[voice_index] += duration
+        return totals
+
+    def _wrong_voices(self, totals):
+        numpy = _import_numpy()
+        if numpy is not None:
+            expected = _as_numpy(numpy, self.expected)[_as_numpy(numpy, self.voice_measure)]
+            first = _as_numpy(numpy, self.voice_number) == 0
+            return numpy.flatnonzero((totals > expected + _EPSILON) | (first & (totals < expected - _EPSILON))).tolist()
+        expected = self.expected
+        return [i for i, (total, measure_index, number) in enumerate(zip(totals, self.voice_measure, self.voice_number))
+                if total > expected[measure_index] + _EPSILON or (number == 0 and total < expected[measure_index] - _EPSILON)]
+
+    def issues(self):
+        '''Checks all measures and returns the issues ordered by staff and measure.'''
+        totals = self.voice_totals()
+        issues = list(self.found)
+        for voice_index in self._wrong_voices(totals):
+            measure_index = self.voice_measure[voice_index]
+            staff_index = self.measure_staff[measure_index]
+            ordinal = self.measure_ordinal[measure_index]
+            number = self.voice_number[voice_index]
+            total = float(totals[voice_index])
+            expected = self.expected[measure_index]
+            issues.append(Issue('overfull' if total > expected else 'underfull', staff_index, ordinal, number,
+                                '{}: {:g} instead of {:g} quarters'.format(_position(staff_index, ordinal, number),
+                                                                          round(total, 4), round(expected, 4))))
+        issues.sort(key=lambda issue: (issue.staff, issue.measure, -1 if issue.voice is None else issue.voice))
+        return issues
+
+
+def validate_tree(tree):
+    '''Returns the issues of a loaded score.'''
+    return ScoreTiming.from_tree(tree).issues()
+
+
+def validate_file(filepath):
+    '''Returns the issues of a .mscx or .mscz file without loading the whole score.'''
+    with instrumentation.operation('validate', filepath):
+        with instrumentation.phase('parse'):
+            timing = ScoreTiming.load(filepath)
+        with instrumentation.phase('check'):
+            return timing.issues()
+
+
+def _validate_file_with_result(filepath):
+    start = time.perf_counter()
+    try:
+        issues = validate_file(filepath)
+    except Exception as e:
+        return ValidationResult(filepath, [], e, time.perf_counter() - start)
+    return ValidationResult(filepath, issues, None, time.perf_counter() - start)
+
+
+def validate_files(files, workers=None):
+    '''Validates files in a pool of worker processes and returns a ValidationResult for each in order.
+
+    Files that cannot be read do not abort the run, their exception is
+    returned in the result. With a single worker no pool is started.
+    '''
+    if workers == 1:
+        return [_validate_file_with_result(f) for f in files]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # several files per task, most scores are validated faster than they are sent to a worker
+        return list(executor.map(_validate_file_with_result, files, chunksize=4))
@@ -0,0 +1,181 @@
+
+'''Watches a directory and converts new or changed scores automatically.
+
+The directory is polled for .mscx and .mscz files. A file is converted once
+its size and modification time have not changed for a while, so files that
+are still being copied are not touched. Conversions run in a pool of worker
+processes with convert_file(), the files written by the conversion itself
+are not converted again. Use it from the command line with:
+
+    python -m mst watch --remove-clefs --fix-key-sig /shared/scores
+'''
+
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import collections
+import concurrent.futures
+
+import musescore
+import instrumentation
+
+
+logger = logging.getLogger('mst_watch')
+
+
+def _ignore_interrupt():
+    # Ctrl+C is handled by the main process, which lets running conversions finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Watcher(object):
+    '''Converts scores in a directory as soon as they have been completely written.
+
+    Files are checked every interval seconds and converted when their size
+    and modification time have been stable for settle seconds. At most
+    workers conversions run at the same time, further files are queued in
+    the order they were found and started as soon as a worker is free. Files already in the directory are only
+    converted with include_existing. A ConvertManifest (or its path) skips
+    files converted with the same plan before, e.g. by an earlier run.
+    callback is called with the ConvertResult of every converted file.
+    '''
+    def __init__(self, directory, plan, workers=None, interval=0.5, settle=1.0, recursive=False,
+                 include_existing=False, manifest=None, callback=None):
+        self.directory = directory
+        self.plan = plan
+        self.workers = workers or os.cpu_count() or 1
+        self.interval = interval
+        self.settle = settle
+        self.recursive = recursive
+        self.manifest = musescore._get_manifest(manifest)
+        self.callback = callback
+        self.results = []
+        # signature (size, mtime) of every file that needs no conversion
+        self._done = {} if include_existing else self.scan()
+        # files seen changing, with their last signature and the time it was first seen
+        self._changing = {}
+        self._queue = collections.OrderedDict()
+        self._running = {}
+        self._executor = None
+        self._last_scan = None
+
+    @staticmethod
+    def _signature(st):
+        return st.st_size, st.st_mtime_ns
+
+    def scan(self):
+        '''Returns the signatures of all scores in the directory.'''
+        signatures = {}
+        for path in musescore.iter_score_files(self.directory, self.recursive):
+            try:
+                signatures[path] = self._signature(os.stat(path))
+            except OSError:
+                # removed in the meantime
+                pass
+        return signatures
+
+    def poll(self, now=None):
+        '''Collects finished conversions, checks the directory and starts conversions of settled files.
+
+        The directory is only checked if the last check is at least interval seconds ago.
+        '''
+        if now is None:
+            now = time.monotonic()
+        self._collect()
+        if self._last_scan is None or now - self._last_scan >= self.interval:
+            self._last_scan = now
+            self._check(self.scan(), now)
+        self._submit()
+
+    def _check(self, signatures, now):
+        for path, signature in signatures.items():
+            if self._done.get(path) == signature or path in self._running:
+                continue
+            if path in self._queue:
+                if self._queue[path] == signature:
+                    continue
+                del self._queue[path]
+            changing = self._changing.get(path)
+            if changing is None or changing[0] != signature:
+                self._changing[path] = (signature, now)
+            elif now - changing[1] >= self.settle:
+                del self._changing[path]
+                self._queue[path] = signature
+        for path in list(self._changing):
+            if path not in signatures:
+                del self._changing[path]
+
+    def _submit(self):
+        if self._queue and self._executor is None:
+            # initializer is only supported by Python 3.7 and newer
+            options = {'initializer': _ignore_interrupt} if sys.version_info >= (3, 7) else {}
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, **options)
+        # one file more per worker is handed to the pool, so no worker waits for the next poll
+        while self._queue and len(self._running) < 2 * self.workers:
+            path, _ = self._queue.popitem(last=False)
+            manifest = self.manifest.subset(path) if self.manifest is not None else None
+            future = self._executor.submit(musescore._convert_file_with_result, path, self.plan, manifest,
+                                           instrumentation.enabled)
+            self._running[path] = future
+            logger.info('Converting {}'.format(path))
+
+    def _collect(self, wait=False):
+        if not self._running:
+            return
+        done, _ = concurrent.futures.wait(list(self._running.values()), timeout=None if wait else 0)
+        for path, future in list(self._running.items()):
+            if future not in done:
+                continue
+            del self._running[path]
+            result = future.result()
+            try:
+                # the written file must not trigger another conversion
+                self._done[path] = self._signature(os.stat(path))
+            except OSError:
+                pass
+            if result.success:
+                logger.info('Converted {} in {:.2f} s{}'.format(path, result.duration, '' if result.written else ' (unchanged)'))
+                if self.manifest is not None:
+                    self.manifest.update(path, self.plan, result.file_hash)
+            else:
+                logger.error('Could not convert {}: {}'.format(path, result.exception))
+            if result.report is not None:
+                instrumentation.emit(instrumentation.Report.from_dict(result.report))
+            self.results.append(result)
+            if self.callback is not None:
+                self.callback(result)
+
+    def pending(self):
+        '''Returns the number of files waiting for or in conversion.'''
+        return len(self._changing) + len(self._queue) + len(self._running)
+
+    def run(self, stop_event=None):
+        '''Polls the directory until stop_event is set (or forever), then waits for running conversions.'''
+        if stop_event is None:
+            stop_event = threading.Event()
+        logger.info('Watching {} for scores'.format(self.directory))
+        try:
+            while not stop_event.is_set():
+                self.poll()
+                if self._running:
+                    # wake up as soon as a conversion is finished to start the next one
+                    concurrent.futures.wait(list(self._running.values()), timeout=self.interval,
+                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                else:
+                    stop_event.wait(self.interval)
+        finally:
+            self.close()
+
+    def close(self):
+        '''Waits for running conversions and saves the manifest. Queued files are not converted.'''
+        self._queue.clear()
+        while self._running:
+            self._collect(wait=True)
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.manifest is not None:
+            self.manifest.save()